@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+'''
+LRU-кэш, ограниченный суммарным размером значений в байтах
+Может использоваться из нескольких потоков (например, при восстановлении файлов коммита)
+'''
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0   # суммарный размер значений в кэше
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Возвращает значение по ключу или None и учитывает попадание/промах
+        '''
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        '''
+        Добавляет значение, вытесняя давно не использованные
+        Значения больше всего кэша не сохраняются
+        '''
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                key, old_value = self._items.popitem(last=False)
+                self.size -= len(old_value)
+
+    def remove(self, key):
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return f'LRUCache({len(self)} objects, {self.size}/{self.max_bytes} bytes, ' \
+               f'hits={self.hits}, misses={self.misses})'
@@ -0,0 +1,138 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import sparse
+from config import get_setting
+from fs_objects import Tree
+
+'''
+Восстановление (checkout) дерева коммита в рабочую папку.
+План строится сравнением хэшей дерева, которое сейчас лежит в папке, и дерева коммита:
+совпавшие поддеревья и файлы не трогаются, записываются только отличающиеся файлы,
+удаляются только лишние. Файлы записываются в потоках (чтение объектов, распаковка и запись отпускают GIL).
+В режиме выборки (см. sparse.py) записываются только отслеживаемые пути, при смене шаблонов
+записываются пути, вошедшие в выборку, а из вышедших удаляются только файлы дерева: папка удаляется,
+только если после этого она пуста (неотслеживаемые и игнорируемые файлы остаются на месте).
+'''
+
+
+class CheckoutPlan:
+    def __init__(self):
+        self.remove = []    # пути файлов и папок, которые нужно удалить
+        self.prune = []     # пути папок, которые удаляются, только если остались пустыми (вложенные - раньше)
+        self.folders = []   # пути папок, которые нужно создать (родительские - раньше вложенных)
+        self.files = []     # (путь, файл из дерева коммита) - файлы, которые нужно записать
+
+
+def plan_leave(tree, path, rel_path, plan, was):
+    '''
+    Дополняет план удалением папки path, вышедшей из выборки: удаляются отслеживаемые (по was) файлы tree,
+    а папки - только если в них больше ничего не осталось
+    '''
+    for child in tree.children:
+        child_path = os.path.join(path, child.name)
+        child_rel_path = sparse.child_path(rel_path, child.name)
+        if not sparse.tracked(was, child_rel_path, isinstance(child, Tree)):
+            continue    # объекта нет на диске или он не из дерева
+        if isinstance(child, Tree):
+            plan_leave(child, child_path, child_rel_path, plan, was)
+        else:
+            plan.remove.append(child_path)
+    plan.prune.append(path)
+
+
+def plan_folder(current, target, path, rel_path, plan, was, will):
+    '''
+    Дополняет план изменениями, превращающими папку path из current в target
+    :param current: дерево, которое сейчас лежит в папке (None - папки нет или ее содержимое неизвестно)
+    :param rel_path: путь папки относительно корня проекта
+    :param was: шаблоны выборки, по которым на диске лежит current (None - все дерево)
+    :param will: шаблоны выборки, по которым нужно восстановить target
+    '''
+    current_children = {child.name: child for child in current.children} if current is not None else {}
+    target_names = set()
+    for child in target.children:
+        target_names.add(child.name)
+        child_path = os.path.join(path, child.name)
+        child_rel_path = sparse.child_path(rel_path, child.name)
+        old_child = current_children.get(child.name)
+        if old_child is not None and not sparse.tracked(was, child_rel_path, isinstance(old_child, Tree)):
+            old_child = None    # объекта нет на диске
+        if not sparse.tracked(will, child_rel_path, isinstance(child, Tree)):
+            if isinstance(old_child, Tree):
+                plan_leave(old_child, child_path, child_rel_path, plan, was)
+            elif old_child is not None:
+                plan.remove.append(child_path)
+            continue
+        # у папки при смене шаблонов на диске может быть не то содержимое, что в дереве
+        if old_child is not None and old_child.hash == child.hash and (was is will or not isinstance(child, Tree) or
+                sparse.state(was, child_rel_path) == sparse.state(will, child_rel_path) == sparse.INSIDE):
+            continue    # файл или папка не изменились
+        if old_child is not None and isinstance(old_child, Tree) != isinstance(child, Tree):
+            # файл стал папкой или наоборот
+            plan.remove.append(child_path)
+            old_child = None
+        if isinstance(child, Tree):
+            if old_child is None:
+                plan.folders.append(child_path)
+            plan_folder(old_child, child, child_path, child_rel_path, plan, was, will)
+        else:
+            plan.files.append((child_path, child))
+    if current is not None:
+        plan.remove.extend(os.path.join(path, child.name) for child in current.children
+                           if child.name not in target_names and
+                           sparse.tracked(was, sparse.child_path(rel_path, child.name), isinstance(child, Tree)))
+
+
+def plan_checkout(current, target, path, was=None, will=None):
+    '''
+    План восстановления дерева target в папку path/<имя target>
+    :param current: дерево, которое сейчас лежит в этой папке, или None - записать все файлы
+    :param was: шаблоны выборки, по которым восстановлено current
+    :param will: шаблоны выборки для target (см. plan_folder)
+    '''
+    plan = CheckoutPlan()
+    root = os.path.join(path, target.name)
+    if current is None or current.name != target.name:
+        current = None
+        plan.folders.append(root)
+    if current is None or current.hash != target.hash or was is not will:
+        plan_folder(current, target, root, '.', plan, was, will)
+    return plan
+
+
+def write_file(path, file):
+    with open(path, 'wb') as f:
+        file.blob.write_to(f)
+
+
+def run_checkout(plan):
+    '''
+    Выполняет план: удаляет лишнее (и опустевшие папки), создает папки и записывает файлы
+    :return: список путей, которые не удалось найти для удаления
+    '''
+    not_found = []
+    for path in plan.remove:
+        if os.path.isfile(path) or os.path.islink(path):
+            os.remove(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            not_found.append(path)
+    for path in plan.prune:
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass    # папки уже нет или в ней остались неотслеживаемые файлы
+    for path in plan.folders:
+        os.makedirs(path, exist_ok=True)
+    workers = int(get_setting('STORAGE', 'hash_workers')) or os.cpu_count() or 1
+    if workers > 1 and len(plan.files) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() - чтобы исключения потоков поднимались здесь
+            list(executor.map(lambda item: write_file(*item), plan.files))
+    else:
+        for path, file in plan.files:
+            write_file(path, file)
+    return not_found
@@ -0,0 +1,63 @@
+import re
+import zlib
+
+'''
+Разбиение файлов на куски по содержимому (content-defined chunking).
+Граница куска определяется самими данными, а не смещением в файле, поэтому вставка
+или удаление байт в середине файла меняет только соседние куски, остальные совпадают
+с уже сохраненными и не записываются повторно.
+
+Отпечаток окна из WINDOW байт (crc32 - полиномиальный хэш, как у Рабина) проверяется
+не на каждом байте, а только после "якорных" байт (перевод строки, нулевой байт),
+которые ищутся регулярным выражением - так основной цикл выполняется на стороне C.
+'''
+
+WINDOW = 48
+ANCHOR = re.compile(rb'[\n\x00]')
+ANCHOR_DENSITY = 64     # примерное среднее расстояние между якорями (байт)
+
+
+def chunk_limits(avg_size):
+    '''
+    Минимальный и максимальный размер куска и маска отпечатка для среднего размера avg_size
+    '''
+    bits = max(0, (avg_size // ANCHOR_DENSITY).bit_length() - 1)
+    return max(avg_size // 4, WINDOW), avg_size * 4, (1 << bits) - 1
+
+
+def find_cut(data, min_size, max_size, mask, final=False):
+    '''
+    Ищет границу первого куска в data
+    :param final: data - конец файла
+    :return: длина куска или None, если для решения нужно больше данных
+    '''
+    for anchor in ANCHOR.finditer(data, min_size - 1, min(len(data), max_size)):
+        end = anchor.end()
+        if zlib.crc32(data[end - WINDOW:end]) & mask == 0:
+            return end
+    if len(data) >= max_size:
+        return max_size
+    if final:
+        return len(data)
+    return None
+
+
+def iter_cdc_chunks(path, avg_size):
+    '''
+    Читает файл кусками, границы которых определяются содержимым
+    В памяти держится не больше двух максимальных кусков
+    '''
+    min_size, max_size, mask = chunk_limits(avg_size)
+    data = b''
+    final = False
+    with open(path, mode='rb') as file:
+        while data or not final:
+            if not final and len(data) < max_size:
+                block = file.read(max_size)
+                if not block:
+                    final = True
+                data += block
+                continue
+            cut = find_cut(data, min_size, max_size, mask, final)
+            yield data[:cut]
+            data = data[cut:]
@@ -1,14 +1,22 @@
-import copy
 import os
 import shutil
 import time
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import gitignore_parser
 
+import checkout
+import index
+import manifest
+import sparse
+import storage
+import watcher
 from translate import phrase
-from fs_objects import File, Tree, Commit, load
-from config import VCS_FOLDER, BASE_PATH, GITIGNORE, DATA_FOLDER, HEAD_PATH
+from diff import diff_trees, same_content
+from fs_objects import File, Tree, Commit, blob_chunks, load
+from walker import Walker
+from config import VCS_FOLDER, BASE_PATH, DATA_FOLDER, HEAD_PATH, STORAGE_DEFAULTS, DIFF_DEFAULTS, \
+    get_setting
 
 
 def init():
@@ -33,6 +41,10 @@ def create_config():
         # 'email': 'email',
         'lang': 'ru'
     }
+    # параметры хранилища объектов
+    conf['STORAGE'] = dict(STORAGE_DEFAULTS)
+    # параметры сравнения коммитов
+    conf['DIFF'] = dict(DIFF_DEFAULTS)
 
     path = Path(os.path.join(VCS_FOLDER, 'config'))
     # Записываем конфигурационный файл
@@ -70,46 +82,6 @@ except KeyError:
     lang = 'ru'
 
 
-def parse_gitignore(full_path, base_dir=None):
-    if base_dir is None:
-        base_dir = gitignore_parser.dirname(full_path)
-    rules = []
-    with open(full_path, encoding='utf-8') as ignore_file:
-        counter = 0
-        for line in ignore_file:
-            counter += 1
-            line = line.rstrip('\n')
-            rule = gitignore_parser.rule_from_pattern(line, base_path=gitignore_parser._normalize_path(base_dir),
-                                     source=(full_path, counter))
-            if rule:
-                rules.append(rule)
-    if not any(r.negation for r in rules):
-        return lambda file_path: any(r.match(file_path) for r in rules)
-    else:
-        # We have negation rules. We can't use a simple "any" to evaluate them.
-        # Later rules override earlier rules.
-        return lambda file_path: gitignore_parser.handle_negation(file_path, rules)
-
-def obj_in_gitignore(obj, obj_tab, gitignore_stack, gitignore):
-    '''
-    Проверяет находится ли obj в .gitignore
-    :param obj: Путь к объекту файловой системы
-    :param obj_tab: уровень вложенности объекта
-    :param gitignore_stack: список файлов gitignore и их уровней вложенности
-    :return:
-    '''
-    if not gitignore:
-        return False
-    if obj.name == VCS_FOLDER.name:  # игнорируем папку репозитория
-        return True
-    for gitignore_path, tab in gitignore_stack:
-        if tab <= obj_tab:
-            matches = parse_gitignore(gitignore_path)
-            if matches(obj):
-                return True
-    return False
-
-
 def iter_folder(path=BASE_PATH, gitignore=True, print_content=True, create_tree=True):
     '''
     Проходится по файлам и папкам проекта и создает дерево проекта
@@ -120,61 +92,98 @@ def iter_folder(path=BASE_PATH, gitignore=True, print_content=True, create_tree=
     :param copy: нужно ли копировать файлы целиком
     :return: возвращает дерево проекта
     '''
-    stack = [(path, 0)]  # путь к файлу и уровень вложенности
-    gitingore_stack = []  # файлы gitingore и их уровень вложенности
+    # файлы читаются и хэшируются в потоках (чтение и sha1 отпускают GIL)
+    workers = int(get_setting('STORAGE', 'hash_workers')) or os.cpu_count() or 1
+    executor = ThreadPoolExecutor(max_workers=workers) if create_tree and workers > 1 else None
+    pending_files = []  # (дерево, путь относительно корня проекта, stat, File или будущий File) в порядке обхода
+    walked = []     # пути файлов и папок относительно корня проекта в порядке обхода (для индекса)
+    # папки, изменившиеся с прошлого обхода, по данным наблюдателя (None - просматриваем все папки)
+    new_session, dirty = watcher.changes_since(index.session()) if gitignore else (None, None)
+    sparse_patterns = sparse.load_sparse()
+
+    def list_folder(entry):
+        if dirty is not None and entry.rel_path not in dirty and index.is_folder(entry.rel_path):
+            # папка не изменялась с прошлого обхода - ее содержимое берем из индекса
+            return index.children(entry.rel_path)
+        return None
+
+    walker = Walker(path, gitignore=gitignore, list_folder=list_folder)
     if path == os.getcwd():  # добавляем переход наверх для дерева проекта
-        path = Path(os.path.join('..', stack[0][0].name))
+        path = Path(os.path.join('..', path.name))
 
     root_tree = Tree(path)  # корневое дерево
+    root_name = root_tree.name
     tree_stack = [(root_tree, 0)]  # стек деревьев (папок) и их уровней вложенности
 
-    while stack:
-        current_path, tab = stack.pop()  # берем файл и его уровень вложенности
+    for entry in walker:
+        tab = entry.tab
+
+        if '~$' in entry.name: # пропускаем временные файлы (папки с ними в пути уже пропущены)
+            entry.skip = True
+            continue
 
-        if '~$' in str(current_path): # пропускаем временные файлы
+        if sparse_patterns is not None and not sparse.tracked(sparse_patterns, entry.rel_path, entry.is_folder):
+            # вне выборки (sparse checkout): не обходим и не отслеживаем
+            entry.skip = True
             continue
 
         while len(tree_stack) > 0 and tree_stack[-1][1] > tab:
             tree_stack.pop()  # удаляем папки, файлы которых уже перебрали из стека
 
-        if gitignore:
-            # удаляем файл gitignore из стека, когда перебрали все файлы в его уровне вложенности
-            while len(gitingore_stack) > 0 and gitingore_stack[-1][1] > tab:
-                gitingore_stack.pop()
-
-            gitignore_path = Path.joinpath(current_path.parent, GITIGNORE)
-            if gitignore_path.exists() and (gitignore_path, tab) not in gitingore_stack:
-                gitingore_stack.append((gitignore_path, tab))
-
-        if not obj_in_gitignore(current_path, tab, gitingore_stack, gitignore):
-            # создаем дерево проекта
-            if create_tree:
-                if current_path.name != Path(path).name:  # корневую папку игнорируем
-                    if not current_path.is_dir():
-                        file = File(current_path)
-                        tree_stack[-1][0].add_child(file)  # добавляем файл в дерево
+        # создаем дерево проекта
+        if create_tree:
+            walked.append(entry.rel_path)
+            if entry.is_folder:
+                index.add_folder(entry.rel_path)
+            if entry.name != root_name:  # корневую папку игнорируем
+                # тип объекта известен из обхода - объекты создаются без повторной проверки пути
+                if not entry.is_folder:
+                    if entry.from_index:
+                        # папка не изменялась - файл не проверяем
+                        st = None
+                        (size, *_), blob_hash = index.entry(entry.rel_path)
+                        file = File.from_index(entry.path, entry.name, blob_hash, size)
                     else:
-                        tree = Tree(current_path)
-                        tree_stack[-1][0].add_child(tree)  # добавляем дерево в дерево
-                        tree_stack.append((tree, tab + 1))
-
-            # если объект - папка, то добавляем его содержимое в стек
-            if current_path.is_dir():
-                # subfolders = reversed(list(current_path.iterdir()))
-                subfolders = [p for p in current_path.iterdir() if p.is_file()][::-1] + [p for p in current_path.iterdir() if p.is_dir()][::-1]
-                for obj in subfolders:
-                    stack.append((obj, tab + 1))
-
-            if print_content:
-                if len(stack) > 0 and stack[-1][1] < tab:   # последний объект в текущей папке
-                    # print('│   ' * (stack[-1][1]), '└───' * (tab - stack[-1][1] - 1), '┴── ' if (tab - stack[-1][1] - 1) > 0 else '└── ', current_path.name, sep='')
-                    print('│   ' * (stack[-1][1]), '└───' if (tab - stack[-1][1] - 1) > 0 else '',  '┴───' * (tab - stack[-1][1] - 2), '┴── ' if (tab - stack[-1][1] - 1) > 0 else '└── ', current_path.name, sep='')
-                elif len(stack) == 0:   # последний объект в репозитории
-                    # print('└───' * (tab - 1), '└── ' if tab > 0 else '', current_path.name, sep='')
-                    print('└───' * (tab - 1), '┴── ' if (tab - 1) > 0 else '└── ', current_path.name, sep='')
+                        st = entry.stat()
+                        # если stat файла не изменился, хэш берем из индекса, не читая файл
+                        blob_hash = index.lookup(entry.rel_path, st)
+                        if blob_hash is not None:
+                            file = File.from_index(entry.path, entry.name, blob_hash, st.st_size)
+                            st = None   # запись индекса не изменилась
+                        elif executor is not None:
+                            file = executor.submit(File.from_walk, entry.path, entry.name)
+                        else:
+                            file = File.from_walk(entry.path, entry.name)
+                    pending_files.append((tree_stack[-1][0], entry.rel_path, st, file))
                 else:
-                    # будет выведено по ошибке у последнего объекта, если следующий после него файл в gitignore
-                    print('│   ' * (tab - 1), '├── ' if tab > 0 else '', current_path.name, sep='')
+                    tree = Tree.from_walk(entry.name)
+                    tree_stack[-1][0].add_child(tree)  # добавляем дерево в дерево
+                    tree_stack.append((tree, tab + 1))
+
+        if print_content:
+            next_tab = walker.peek_tab()
+            if next_tab is not None and next_tab < tab:   # последний объект в текущей папке
+                # print('│   ' * (next_tab), '└───' * (tab - next_tab - 1), '┴── ' if (tab - next_tab - 1) > 0 else '└── ', entry.name, sep='')
+                print('│   ' * (next_tab), '└───' if (tab - next_tab - 1) > 0 else '',  '┴───' * (tab - next_tab - 2), '┴── ' if (tab - next_tab - 1) > 0 else '└── ', entry.name, sep='')
+            elif next_tab is None:   # последний объект в репозитории
+                # print('└───' * (tab - 1), '└── ' if tab > 0 else '', entry.name, sep='')
+                print('└───' * (tab - 1), '┴── ' if (tab - 1) > 0 else '└── ', entry.name, sep='')
+            else:
+                # будет выведено по ошибке у последнего объекта, если следующий после него файл временный (~$)
+                print('│   ' * (tab - 1), '├── ' if tab > 0 else '', entry.name, sep='')
+
+    # в каждой папке файлы обходятся после вложенных папок, поэтому добавление файлов после обхода
+    # в порядке обхода дает то же дерево (и тот же хэш), что и добавление во время обхода
+    for tree, rel_path, st, file in pending_files:
+        if not isinstance(file, File):
+            file = file.result()    # файл хэшировался в потоке
+        if st is not None:
+            index.update(rel_path, st, file.blob_hash)
+        tree.add_child(file)  # добавляем файл в дерево
+    if executor is not None:
+        executor.shutdown()
+    if create_tree:
+        index.save_index(walked, new_session)
     return root_tree
 
 def make_commit(path=BASE_PATH, gitignore=True, print_content=True):
@@ -188,39 +197,59 @@ def make_commit(path=BASE_PATH, gitignore=True, print_content=True):
     '''
 
     tree = iter_folder(path=path, gitignore=gitignore, print_content=print_content)
+    sparse_patterns = sparse.load_sparse()
+    if sparse_patterns is not None and HEAD_PATH.exists():
+        # вне выборки дерево не изменилось - переносим его из HEAD. Дерево HEAD берем из хранилища,
+        # а не из манифеста: в нем сохранен порядок объектов, от которого зависит хэш.
+        # Загружаются только папки, частично входящие в выборку
+        with open(HEAD_PATH, 'r') as file:
+            head_tree = load_commit(file.read()).tree
+        tree = sparse.graft(tree, head_tree, sparse_patterns)
     return Commit(tree)
 
 
+def update_head(commit_hash):
+    '''
+    Атомарно записывает хэш текущего коммита в HEAD
+    '''
+    storage.atomic_write(HEAD_PATH, commit_hash.encode('utf-8'))
+
+
 def save_commit(new_commit):
     '''
     Сохраняет коммит и обновляет HEAD
     '''
     head = Path(os.path.join(VCS_FOLDER, 'HEAD'))
-    if not head.exists():  # создаем HEAD, записываем туда хэш коммита
-        with open(head, 'w') as file:
-            file.write(new_commit.hash)
-        # сохраняем коммит
-        new_commit.save(DATA_FOLDER)
+    if not head.exists():
+        # сохраняем коммит, затем создаем HEAD и записываем туда хэш коммита
+        with storage.Batch():
+            new_commit.save(DATA_FOLDER)
+        manifest.write_manifest(new_commit.hash, new_commit.tree)
+        update_head(new_commit.hash)
         print(f"{phrase['Сохранен коммит'][lang]} {new_commit.hash}")
+        auto_gc()
     else:
         with open(head, 'r') as file:
             prev_commit_hash = file.read()
         # загружаем предыдущий коммит
-        prev_commit = load(os.path.join(DATA_FOLDER, prev_commit_hash))
+        prev_commit = load(prev_commit_hash)
         # указываем у нового коммита в качестве родителя пред предыдущий коммит, чтобы родители не учитывались при сравнении
         new_commit = Commit(new_commit.tree, prev_commit.parent_hash)
-        if prev_commit_hash != new_commit.hash:
+        # деревья, отличающиеся только порядком объектов, считаем одинаковыми
+        if prev_commit_hash != new_commit.hash and not same_content(load_tree(prev_commit_hash), new_commit.tree):
             # TODO - это не поменяет хэш коммита, так как хеш создается в конструкторе
             # new_commit.parent_hash = prev_commit_hash
             # TODO: переписать код, чтобы не создавать коммит 3 раза
             # указываем у нового коммита в качестве родителя предыдущий
             new_commit = Commit(new_commit.tree, prev_commit_hash)
-            # сохраняем коммит
-            new_commit.save(DATA_FOLDER)
+            # сохраняем коммит (HEAD обновляем только после того, как все объекты на диске)
+            with storage.Batch():
+                new_commit.save(DATA_FOLDER)
+            manifest.write_manifest(new_commit.hash, new_commit.tree, manifest.load_manifest(prev_commit_hash))
             print(f"{phrase['Сохранен коммит'][lang]} {new_commit.hash}")
-            # обновляем HEAD
-            with open(head, 'w') as file:
-                file.write(new_commit.hash)
+            update_head(new_commit.hash)
+            # упаковываем накопившиеся loose-объекты
+            auto_gc()
         else:
             # новый коммит = предыдущий коммит
             print(f"{phrase['Коммит не создан. Нет изменений'][lang]}")
@@ -231,67 +260,55 @@ def load_commit(commit_hash):
     '''
     Загружаем коммит из файлов
     '''
-    path = os.path.join(DATA_FOLDER, commit_hash)
-    if not os.path.exists(path):
+    if not storage.has_object(commit_hash):
         raise Exception(f"{phrase['Нет коммита'][lang]} {commit_hash}")
-    commit = load(path)
+    commit = load(commit_hash)
     commit.load()
     return commit
 
 
-def restore_commit(commit_hash, path=BASE_PATH):
+def load_tree(commit_hash):
+    '''
+    Дерево коммита: по манифесту, если он есть, иначе из хранилища
+    '''
+    tree = manifest.load_manifest(commit_hash)
+    if tree is None:
+        tree = load_commit(commit_hash).tree
+    return tree
+
+
+def restore_commit(commit_hash, path=BASE_PATH, current_tree=None):
     '''
     Восстанавливает файлы из коммита
     :param path: куда восстановить коммит
+    :param current_tree: дерево рабочей папки (см. make_commit) - тогда записываются только файлы,
+        которые отличаются от коммита, и удаляются лишние. Без него коммит восстанавливается целиком,
+        а удаляются пути, удаленные и измененные между HEAD и коммитом
     '''
     # переходим на уровень вверх если корневая папка (иначе имя проекта будет дублироваться)
     if path == BASE_PATH:
         path = path.parent
-    # удаляем все файлы которых в коммите не было, и те которые были изменены
-    changes_list = status(path, new_commit_hash=commit_hash)
-    for change in changes_list:
-        if change[0] in '-?':
-            p = os.path.join(path, change[1])
-            try:
-                if os.path.isfile(p):
-                    os.remove(p)
-                elif os.path.isdir(p):
-                    shutil.rmtree(p)
-                else:
-                    print(f"{phrase['Не найдено для удаления'][lang]}:", p)
-            except FileNotFoundError as e:
-                print(e)
+    target_tree = load_tree(commit_hash)
+    # в режиме выборки восстанавливаются только пути из нее
+    sparse_patterns = sparse.load_sparse()
+    if current_tree is not None:
+        changes_list = diff_trees(current_tree, target_tree, sparse_patterns)
+        if current_tree.hash == target_tree.hash:
+            print(f"{phrase['Изменений нет'][lang]}")
+    else:
+        changes_list = status(path, new_commit_hash=commit_hash)
+
+    plan = checkout.plan_checkout(current_tree, target_tree, path, sparse_patterns, sparse_patterns)
+    if current_tree is None:
+        # содержимое папки неизвестно: удаляем то, чего нет в коммите относительно HEAD
+        plan.remove.extend(os.path.join(path, change[1]) for change in changes_list if change[0] in '-?')
+    for p in checkout.run_checkout(plan):
+        print(f"{phrase['Не найдено для удаления'][lang]}:", p)
     for change in changes_list:
         print(*change)
 
-    commit = load_commit(commit_hash)
-    try:
-        os.mkdir(os.path.join(path, commit.tree.name))
-    except FileExistsError as e:
-        pass
-    # добавляем папку проекта к пути
-    tree_stack = [commit.tree.name]
-
-    # проходимся по дереву коммита и восстанавливаем файлы и папки
-    def walk_tree(tree, tree_stack):
-        for child in tree.children:
-            if isinstance(child, File):
-                with open(os.path.join(path, *tree_stack, child.name), 'wb') as f:
-                    f.write(child.blob.content)
-            elif isinstance(child, Tree):
-                try:
-                    os.mkdir(os.path.join(path, *tree_stack, child.name))
-                except FileExistsError as e:
-                    pass
-                tree_stack.append(child.name)
-                walk_tree(child, tree_stack)
-                tree_stack.pop()
-
-    walk_tree(commit.tree, tree_stack)
-
     # обновляем хэш коммита в HEAD
-    with open(HEAD_PATH, 'w') as file:
-        file.write(commit_hash)
+    update_head(commit_hash)
 
 
 def commit_history(briefly=True):
@@ -307,12 +324,12 @@ def commit_history(briefly=True):
         # добавляем последний коммит
         with open(HEAD_PATH, 'r') as file:
             last_commit_hash = file.read()
-        commit = load(os.path.join(DATA_FOLDER, last_commit_hash))
+        commit = load(last_commit_hash)
         commits.append(commit.hash)
 
         # проходимся по всем предыдущим коммитам
         while commit.parent_hash is not None:
-            commit = load(os.path.join(DATA_FOLDER, commit.parent_hash))
+            commit = load(commit.parent_hash)
             commits.append(commit.hash)
 
         # берем в убыв порядке и оставляем только 4 символа хэша
@@ -328,7 +345,8 @@ def status(path=BASE_PATH, old_commit_hash=None, new_commit_hash=None, gitignore
     ('+', <filename>)  добавление файла
     ('-', <filename>) удаление файла
     ('?', <filename>) изменение файла
-    ('?', <filename>, '>', > <new_filename>) переименование файла
+    ('?', <filename>, '>', > <new_filename>) переименование файла (в том числе с изменением содержимого)
+    ('+', <filename>, '<', <source_filename>) копия файла
     :param path: путь по которому проверяется статус
     :param old_commit_hash: из какого коммита нужно сделать new_commit_hash
     :param new_commit_hash: коммит в который должны перейти
@@ -336,10 +354,9 @@ def status(path=BASE_PATH, old_commit_hash=None, new_commit_hash=None, gitignore
     changes_list = []
 
     if new_commit_hash is None:  # создаем новый коммит
-        new_commit = make_commit(path, print_content=False, gitignore=gitignore)
+        new_tree = make_commit(path, print_content=False, gitignore=gitignore).tree
     else:
-        new_commit = load(os.path.join(DATA_FOLDER, new_commit_hash))
-        new_commit.load()
+        new_tree = load_tree(new_commit_hash)
 
     if old_commit_hash is None:  # берем последний коммит
         if not VCS_FOLDER.exists():
@@ -350,98 +367,137 @@ def status(path=BASE_PATH, old_commit_hash=None, new_commit_hash=None, gitignore
             return changes_list
         else:
             with open(HEAD_PATH, 'r') as file:
-                last_commit_hash = file.read()
-            prev_commit = load(os.path.join(DATA_FOLDER, last_commit_hash))
-            prev_commit.load()
-    else:
-        # prev_commit = make_commit(path, print_content=False)
-        prev_commit = load(os.path.join(DATA_FOLDER, old_commit_hash))
-        prev_commit.load()
-
-    # сравниваем prev_commit и new_commit
-    # делаю у коммитов одинаковых родителей, чтобы если нет изменений, совпадали хэши
-    new_commit = Commit(new_commit.tree, prev_commit.parent_hash)
-    if new_commit.hash == prev_commit.hash:
+                old_commit_hash = file.read()
+
+    # сначала сравниваем только корень дерева коммита: если он совпадает, манифест не загружаем
+    if load_commit(old_commit_hash).tree.hash == new_tree.hash:
         print(f"{phrase['Изменений нет'][lang]}")
         return changes_list
-    else:
-        # дерево проекта отличается
-        prev_tree = prev_commit.tree
-        new_tree = new_commit.tree
-        prev_child_hash = ''.join([child.hash for child in prev_tree.children])
-        new_child_hash = ''.join([child.hash for child in new_tree.children])
-        if prev_child_hash == new_child_hash:
-            changes_list.append(('?', prev_tree.name, '>', new_tree.name))
-        else:
-            if prev_tree.name != new_tree.name:
-                changes_list.append(('?', prev_tree.name, '>', new_tree.name))
+    prev_tree = load_tree(old_commit_hash)
 
-            def walk_tree(new_tree, prev_tree, find_deleted=False):
-                for new_child in new_tree.children:
-                    if type(new_child) == Tree:
-                        new_child_hash = ''.join([child.hash for child in new_child.children])
-                    else:
-                        new_child_hash = new_child.blob.hash
-
-                    found = content_changed = False
-                    for prev_child in prev_tree.children:
-                        if new_child.name == prev_child.name:
-                            if new_child.hash == prev_child.hash:
-                                found = True
-                                content_changed = False
-                                # удаляем найденный объект, чтобы он не использовался при поиске
-                                prev_tree.children.remove(prev_child)
-                            else:
-                                found = True
-                                content_changed = True
-                            break
-                        else:
-                            if type(prev_child) == Tree:
-                                prev_child_hash = ''.join([child.hash for child in prev_child.children])
-                            else:
-                                prev_child_hash = prev_child.blob.hash
-
-                            if new_child_hash == prev_child_hash:
-                                if not find_deleted:
-                                    changes_list.append(('?', os.path.join(*tree_stack, prev_child.name), '>',
-                                                         os.path.join(*tree_stack, new_child.name)))
-                                found = True
-                                content_changed = False
-                                prev_tree.children.remove(prev_child)
-                                break
-
-                    # предыдущая версия была найдена
-                    if found and content_changed:
-                        # папка изменилась
-                        if type(new_child) == Tree:
-                            tree_stack.append(new_child.name)
-                            walk_tree(new_child, prev_child, find_deleted)
-                            tree_stack.pop()
-                            prev_tree.children.remove(prev_child)
-                        # файл изменился
-                        else:
-                            if not find_deleted:
-                                changes_list.append(('?', os.path.join(*tree_stack, new_child.name)))
-                            prev_tree.children.remove(prev_child)
-                    elif not found:
-                        if not find_deleted:
-                            if type(new_child) == Tree:
-                                changes_list.append(('+', os.path.join(*tree_stack, new_child.name)))
-                            else:
-                                changes_list.append(('+', os.path.join(*tree_stack, new_child.name)))
-                        else:
-                            if type(new_child) == Tree:
-                                changes_list.append(('-', os.path.join(*tree_stack, new_child.name)))
-                            else:
-                                changes_list.append(('-', os.path.join(*tree_stack, new_child.name)))
-
-            tree_stack = [new_tree.name]
-            prev_tree_copy = copy.deepcopy(prev_tree)
-            walk_tree(new_tree, prev_tree_copy)
-            walk_tree(prev_tree, new_tree, find_deleted=True)
-            # TODO: объект перемещен. Также если объкт переименован и немного изменен, будет создаваться новый файл
-            #  и удаляться старый, хотя по сути это переименование
+    # сравниваем деревья коммитов (у коммитов с одинаковым родителем хэши совпадают, только если совпадают деревья)
+    if same_content(prev_tree, new_tree):
+        print(f"{phrase['Изменений нет'][lang]}")
         return changes_list
+    # дерево проекта отличается
+    return diff_trees(prev_tree, new_tree)
+
+
+def sparse_checkout(patterns):
+    '''
+    Выборочное восстановление: в рабочей папке остаются только пути, подходящие под шаблоны
+    (без шаблонов - восстанавливается весь проект). Перед сменой шаблонов изменения сохраняются коммитом
+    '''
+    if HEAD_PATH.exists():
+        save_commit(make_commit(print_content=False))
+    was = sparse.load_sparse()
+    sparse.save_sparse(patterns)
+    will = sparse.load_sparse()
+    if HEAD_PATH.exists():
+        with open(HEAD_PATH, 'r') as file:
+            head_tree = load_tree(file.read())
+        plan = checkout.plan_checkout(head_tree, head_tree, BASE_PATH.parent, was, will)
+        for p in checkout.run_checkout(plan):
+            print(f"{phrase['Не найдено для удаления'][lang]}:", p)
+    if will is None:
+        print(f"{phrase['Выборочное восстановление выключено'][lang]}")
+    else:
+        print(f"{phrase['Выборочное восстановление'][lang]}:", *patterns)
+
+
+def walk_history():
+    '''
+    Обходит историю коммитов от HEAD к первому коммиту. Неизменившиеся поддеревья обходятся один раз
+    :return: множество хэшей достижимых объектов и версии файлов - кандидаты в базы дельт
+        (списки хэшей версий одного файла, для больших файлов - еще и одного куска файла, от новых к старым)
+    '''
+    reachable = set()
+    series = {}
+    if not HEAD_PATH.exists():
+        return reachable, []
+
+    def add_version(key, obj_hash):
+        versions = series.setdefault(key, [])
+        if not versions or versions[-1] != obj_hash:
+            versions.append(obj_hash)
+
+    def walk_tree(tree, tree_path):
+        if tree.hash in reachable:
+            return
+        reachable.add(tree.hash)
+        for child in tree.children:
+            child_path = os.path.join(tree_path, child.name)
+            if isinstance(child, Tree):
+                walk_tree(child, child_path)
+                continue
+            reachable.add(child.hash)
+            blob_hash = child.blob_hash
+            add_version(child_path, blob_hash)
+            if blob_hash not in reachable:
+                reachable.add(blob_hash)
+                chunks = blob_chunks(blob_hash) or []
+                reachable.update(chunks)
+                # куски большого файла с одним номером - версии одного и того же участка
+                for i, chunk_hash in enumerate(chunks):
+                    add_version((child_path, i), chunk_hash)
+
+    with open(HEAD_PATH, 'r') as file:
+        commit_hash = file.read()
+    while commit_hash is not None:
+        reachable.add(commit_hash)
+        commit = load_commit(commit_hash)
+        walk_tree(commit.tree, commit.tree.name)
+        commit_hash = commit.parent_hash
+    return reachable, list(series.values())
+
+
+def gc(verbose=True):
+    '''
+    Сборка мусора: удаляет объекты, недостижимые из HEAD (например, коммиты, от которых откатились),
+    остальные объекты упаковывает в один pack-файл
+    Недостижимые объекты моложе gc_grace секунд не удаляются - к ним еще можно откатиться
+    '''
+    if not HEAD_PATH.exists():
+        return
+    reachable, series = walk_history()
+    expire = time.time() - int(get_setting('STORAGE', 'gc_grace'))
+    count, size = storage.collect_garbage(reachable, expire, series)
+    manifest.remove_manifests(reachable, expire)
+    if verbose:
+        print(f"{phrase['Удалено объектов'][lang]}: {count}, {phrase['освобождено байт'][lang]}: {size}")
+
+
+def auto_gc():
+    '''
+    Упаковывает накопившиеся loose-объекты и мелкие pack-файлы, если их больше порога pack_threshold
+    (pack_limit). Историю не обходит: недостижимые объекты удаляет и дельты подбирает команда gc
+    '''
+    if storage.needs_repack():
+        storage.consolidate()
+
+
+def watch():
+    '''
+    Наблюдает за изменениями в проекте (inotify), чтобы status и commit просматривали только измененные папки
+    '''
+    print(f"{phrase['Наблюдение за изменениями запущено'][lang]}")
+    watcher.watch()
+
+
+def repack():
+    '''
+    Упаковывает все объекты репозитория в один pack-файл, похожие версии файлов хранятся дельтами
+    '''
+    count = storage.repack(walk_history()[1])
+    print(f"{phrase['Упаковано объектов'][lang]}: {count}")
+
+
+def migrate():
+    '''
+    Переводит loose-объекты старого репозитория на раскладку по подпапкам
+    '''
+    count = storage.migrate_loose()
+    print(f"{phrase['Перенесено объектов'][lang]}: {count}")
 
 
 def remove_repo():
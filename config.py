@@ -1,3 +1,4 @@
+import configparser
 import os
 from pathlib import Path
 
@@ -5,5 +6,62 @@ BASE_PATH = Path(os.getcwd())
 # BASE_PATH = Path(os.path.join(BASE_PATH, 'folder'))
 VCS_FOLDER = Path(os.path.join(BASE_PATH, '.vcs'))
 DATA_FOLDER = Path(os.path.join(VCS_FOLDER, 'data'))
+PACK_FOLDER = Path(os.path.join(VCS_FOLDER, 'pack'))
+OBJECTS_INDEX_PATH = Path(os.path.join(VCS_FOLDER, 'objects'))
+OBJECT_TIMES_PATH = Path(os.path.join(VCS_FOLDER, 'gc_times'))
 HEAD_PATH = Path(os.path.join(VCS_FOLDER, 'HEAD'))
+CONFIG_PATH = Path(os.path.join(VCS_FOLDER, 'config'))
+INDEX_PATH = Path(os.path.join(VCS_FOLDER, 'index'))
+WATCH_STATE_PATH = Path(os.path.join(VCS_FOLDER, 'watch'))
+DIRTY_LOG_PATH = Path(os.path.join(VCS_FOLDER, 'dirty'))
+WATCH_COOKIES_FOLDER = Path(os.path.join(VCS_FOLDER, 'cookies'))
+MANIFEST_FOLDER = Path(os.path.join(VCS_FOLDER, 'manifest'))
+SPARSE_PATH = Path(os.path.join(VCS_FOLDER, 'sparse'))
 GITIGNORE = '.gitignore'
+
+# параметры хранилища по умолчанию (переопределяются секцией STORAGE в .vcs/config)
+STORAGE_DEFAULTS = {
+    'pack_threshold': '1000',   # после какого числа loose-объектов они упаковываются в pack
+    'pack_limit': '50',         # то же для числа pack-файлов (каждый коммит записывается отдельным pack-файлом)
+    'chunk_size': '4194304',    # размер куска (байт), которым читаются и сохраняются большие файлы
+    'chunking': 'fixed',        # fixed - куски фиксированного размера, cdc - границы по содержимому
+    'cdc_avg_size': '1048576',  # средний размер куска в режиме cdc
+    'compression': 'zlib',      # сжатие объектов: zlib, lzma или none
+    'compression_level': '6',
+    'cache_size': '67108864',   # размер кэша прочитанных объектов (байт)
+    'hash_workers': '0',        # число потоков для чтения, хэширования и записи файлов (0 - по числу ядер)
+    'delta_depth': '10',        # максимальная длина цепочки дельт в pack-файле
+    'gc_grace': '1209600',      # недостижимые объекты моложе стольких секунд (2 недели) не удаляются
+}
+
+# параметры сравнения коммитов по умолчанию (секция DIFF в .vcs/config)
+DIFF_DEFAULTS = {
+    'rename_threshold': '50',   # минимальное сходство содержимого (%), при котором файлы считаются переименованием
+    'rename_limit': '100000',   # сколько пар файлов сравнивается по содержимому (0 - только точные совпадения)
+    'rename_max_size': '16777216',  # файлы больше (байт) по содержимому не сравниваются
+}
+
+# параметры наблюдателя по умолчанию (секция WATCH в .vcs/config)
+WATCH_DEFAULTS = {
+    'cookie_timeout': '1',      # сколько секунд обход ждет, пока наблюдатель допишет журнал (дольше - полный обход)
+}
+
+DEFAULTS = {'STORAGE': STORAGE_DEFAULTS, 'DIFF': DIFF_DEFAULTS, 'WATCH': WATCH_DEFAULTS}
+
+
+_settings = None    # .vcs/config, читается один раз за команду
+
+
+def get_setting(section, param, default=None):
+    '''
+    Читает параметр из .vcs/config
+    Если параметра (или самого файла) нет - возвращает значение по умолчанию
+    '''
+    global _settings
+    if _settings is None:
+        _settings = configparser.ConfigParser()
+        _settings.read(CONFIG_PATH)
+    conf = _settings
+    if default is None:
+        default = DEFAULTS.get(section, {}).get(param)
+    return conf.get(section, param, fallback=default)
@@ -7,6 +7,7 @@ from pathlib import Path
 from cryptography.fernet import Fernet
 
 from config import BASE_PATH, VCS_FOLDER
+from walker import Walker
 
 
 def generate_key():
@@ -85,36 +86,32 @@ def decrypt_message(ciphertext, key):
 
 
 def encrypt_folder(key, encrypt: bool, path=BASE_PATH, print_content=True):
-    stack = [(path, 0)]  # путь к файлу и уровень вложенности
-
-    while stack:
-        current_path, tab = stack.pop()  # берем файл и его уровень вложенности
-
+    walker = Walker(path, gitignore=False, folders_first=False)
+    for entry in walker:
         if print_content:
-            print('|   ' * (tab - 1), '+ - ' if tab > 0 else '', current_path.name, sep='')
+            print('|   ' * (entry.tab - 1), '+ - ' if entry.tab > 0 else '', entry.name, sep='')
 
-        if current_path.is_dir():
-            if current_path == VCS_FOLDER:  # skip vcs folder
+        if entry.is_folder:
+            if entry.path == str(VCS_FOLDER):  # skip vcs folder
+                entry.skip = True
                 continue
 
-            if current_path != path:   # корневую папку не шифруем
-                old_current_path = current_path
+            if entry.tab > 0:   # корневую папку не шифруем
                 if encrypt:
                     # шифруем имя файла. для шифра нужен ключ 16 байт или другая степень 2ки
-                    new_folder_name = encrypt_message(current_path.name, key[:16])
+                    new_folder_name = encrypt_message(entry.name, key[:16])
                 else:
-                    new_folder_name = decrypt_message(current_path.name, key[:16])
-                current_path = Path(os.path.join(current_path.parent, new_folder_name))
-                os.rename(old_current_path, current_path)
-            subfolders = reversed(list(current_path.iterdir()))
-            for obj in subfolders:
-                stack.append((obj, tab + 1))
+                    new_folder_name = decrypt_message(entry.name, key[:16])
+                new_path = os.path.join(os.path.dirname(entry.path), new_folder_name)
+                os.rename(entry.path, new_path)
+                # вложенные записи найдут себя по новому пути папки
+                entry.path = new_path
         else:
             pass
             if encrypt:
-                encrypt_file(current_path, key)
+                encrypt_file(Path(entry.path), key)
             else:
-                decrypt_file(current_path, key)
+                decrypt_file(Path(entry.path), key)
 
 
 if __name__ == '__main__':
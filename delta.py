@@ -0,0 +1,102 @@
+import struct
+
+'''
+Двоичные дельты: целевые данные описываются как последовательность команд
+"скопировать участок базы" и "вставить новые байты".
+Участки базы ищутся по блокам из BLOCK байт: база индексируется по выровненным блокам,
+а в целевых данных блок ищется с каждой позиции, после чего совпадение расширяется в обе стороны.
+'''
+
+BLOCK = 16
+COPY, INSERT = b'C', b'I'
+DELTA_HEADER = struct.Struct('>Q')  # размер целевых данных
+COPY_OP = struct.Struct('>QI')      # смещение в базе, длина
+INSERT_OP = struct.Struct('>I')     # длина вставки (за ней сами байты)
+
+
+def match_length(base, base_offset, target, target_offset):
+    '''
+    Длина совпадающего участка base[base_offset:] и target[target_offset:]
+    Сравниваем кусками, размер которых растет при совпадении и уменьшается при расхождении
+    '''
+    limit = min(len(base) - base_offset, len(target) - target_offset)
+    length = 0
+    step = BLOCK
+    while length < limit:
+        size = min(step, limit - length)
+        if base[base_offset + length:base_offset + length + size] == target[target_offset + length:target_offset + length + size]:
+            length += size
+            step *= 2
+        elif size == 1:
+            break
+        else:
+            step = size // 2
+    return length
+
+
+def make_delta(base: bytes, target: bytes, max_insert=None):
+    '''
+    Строит дельту, превращающую base в target
+    :param max_insert: если новых байт получается больше - дельта не выгодна, возвращаем None
+    '''
+    if max_insert is None:
+        max_insert = len(target)
+    index = {}
+    for offset in range(0, len(base) - BLOCK + 1, BLOCK):
+        index.setdefault(base[offset:offset + BLOCK], offset)
+
+    ops = [DELTA_HEADER.pack(len(target))]
+    inserted = 0
+    insert_start = 0
+    i = 0
+    while i <= len(target) - BLOCK:
+        base_offset = index.get(target[i:i + BLOCK])
+        if base_offset is None:
+            i += 1
+            if i - insert_start + inserted > max_insert:
+                return None
+            continue
+        # расширяем совпадение назад, за счет еще не записанной вставки
+        while i > insert_start and base_offset > 0 and target[i - 1] == base[base_offset - 1]:
+            i -= 1
+            base_offset -= 1
+        length = match_length(base, base_offset, target, i)
+        if i > insert_start:
+            ops += [INSERT, INSERT_OP.pack(i - insert_start), target[insert_start:i]]
+            inserted += i - insert_start
+        ops += [COPY, COPY_OP.pack(base_offset, length)]
+        i += length
+        insert_start = i
+    if insert_start < len(target):
+        ops += [INSERT, INSERT_OP.pack(len(target) - insert_start), target[insert_start:]]
+        inserted += len(target) - insert_start
+    if inserted > max_insert:
+        return None
+    return b''.join(ops)
+
+
+def apply_delta(base, delta) -> bytes:
+    '''
+    Восстанавливает целевые данные по базе и дельте
+    '''
+    size, = DELTA_HEADER.unpack_from(delta)
+    result = []
+    position = DELTA_HEADER.size
+    while position < len(delta):
+        op = delta[position:position + 1]
+        position += 1
+        if op == COPY:
+            offset, length = COPY_OP.unpack_from(delta, position)
+            position += COPY_OP.size
+            result.append(base[offset:offset + length])
+        elif op == INSERT:
+            length, = INSERT_OP.unpack_from(delta, position)
+            position += INSERT_OP.size
+            result.append(delta[position:position + length])
+            position += length
+        else:
+            raise Exception('Поврежденная дельта')
+    data = b''.join(result)
+    if len(data) != size:
+        raise Exception('Поврежденная дельта')
+    return data
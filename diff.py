@@ -0,0 +1,259 @@
+import bisect
+import heapq
+import os
+from collections import Counter
+
+import similarity
+import sparse
+from config import get_setting
+from fs_objects import File, Tree, get_sha1_hash
+
+'''
+Сравнение деревьев проекта (используется в status и при откате коммита).
+Дочерние объекты папки сопоставляются через словари: сначала по имени, затем оставшиеся - по содержимому
+(переименование). Поддерево, хэш которого совпал, не обходится и не загружается из хранилища,
+сравниваемые деревья не копируются и не изменяются.
+Затем по всему проекту ищутся переименования между папками и переименования с изменением содержимого
+(по сходству файлов, см. similarity.py), а также копии.
+
+Изменения:
+('+', <путь>) добавление, ('-', <путь>) удаление, ('?', <путь>) изменение,
+('?', <старый путь>, '>', <новый путь>) переименование, ('+', <путь>, '<', <путь источника>) копия
+'''
+
+EMPTY_BLOB_HASH = get_sha1_hash(b'')
+
+
+def content_hash(obj):
+    '''
+    Хэш содержимого без учета имени: у файла - хэш блоба, у папки - хэши ее дочерних объектов
+    (в отсортированном виде: в дереве из манифеста объекты упорядочены по имени, в рабочей папке - нет)
+    '''
+    if isinstance(obj, Tree):
+        return ''.join(sorted(child.hash for child in obj.children))
+    return obj.blob_hash
+
+
+def same_content(prev_tree, new_tree):
+    '''
+    Совпадают ли деревья без учета порядка дочерних объектов (от него зависит хэш дерева, а порядок
+    обхода папки может отличаться, например, после выборочного восстановления)
+    '''
+    if prev_tree.hash == new_tree.hash:
+        return True
+    if prev_tree.name != new_tree.name:
+        return False
+    prev_by_name = {child.name: child for child in prev_tree.children}
+    if len(prev_by_name) != len(new_tree.children):
+        return False
+    for new_child in new_tree.children:
+        prev_child = prev_by_name.get(new_child.name)
+        if prev_child is None or isinstance(prev_child, Tree) != isinstance(new_child, Tree):
+            return False
+        if prev_child.hash != new_child.hash and \
+                not (isinstance(new_child, Tree) and same_content(prev_child, new_child)):
+            return False
+    return True
+
+
+def diff_folder(prev_tree, new_tree, path, changes, objects, sparse_patterns=None, rel_path='.'):
+    '''
+    Сравнивает содержимое папок и дописывает в changes добавления, изменения и переименования
+    (в порядке обхода new_tree)
+    :param path: путь папки
+    :param objects: сюда записываются объекты добавлений, удалений и изменений файлов (предыдущая версия)
+    :param sparse_patterns: шаблоны выборки (см. sparse.py) - объекты вне выборки не сравниваются
+    :param rel_path: путь папки относительно корня проекта
+    :return: удаления (в порядке обхода prev_tree) - их выводим после остальных изменений
+    '''
+    prev_children, new_children = prev_tree.children, new_tree.children
+    if sparse_patterns is not None:
+        prev_children = [child for child in prev_children
+                         if sparse.tracked(sparse_patterns, sparse.child_path(rel_path, child.name), isinstance(child, Tree))]
+        new_children = [child for child in new_children
+                        if sparse.tracked(sparse_patterns, sparse.child_path(rel_path, child.name), isinstance(child, Tree))]
+    prev_by_name = {child.name: child for child in prev_children}
+    new_names = {child.name for child in new_children}
+    # удаленные (или переименованные) объекты; по содержимому индексируем, только если есть новые объекты
+    removed = [child for child in prev_children if child.name not in new_names]
+    by_content = None
+    nested = {}         # имя папки -> удаления внутри нее
+    renamed = set()     # имена переименованных объектов prev_tree
+    for new_child in new_children:
+        child_path = os.path.join(path, new_child.name)
+        prev_child = prev_by_name.get(new_child.name)
+        if prev_child is not None:
+            if prev_child.hash == new_child.hash:
+                continue    # объект не изменился, внутрь не заходим
+            if isinstance(new_child, Tree) and isinstance(prev_child, Tree):
+                nested[new_child.name] = diff_folder(prev_child, new_child, child_path, changes, objects,
+                                                     sparse_patterns, sparse.child_path(rel_path, new_child.name))
+            else:
+                changes.append(('?', child_path))
+                if isinstance(new_child, File) and isinstance(prev_child, File):
+                    objects[child_path] = prev_child
+            continue
+        if removed and by_content is None:
+            by_content = {}
+            for child in removed:
+                by_content.setdefault(content_hash(child), []).append(child)
+        candidates = by_content.get(content_hash(new_child)) if removed else None
+        if candidates:
+            # переименование: содержимое нового объекта совпадает с содержимым удаленного
+            prev_child = candidates.pop(0)
+            changes.append(('?', os.path.join(path, prev_child.name), '>', child_path))
+            renamed.add(prev_child.name)
+        else:
+            changes.append(('+', child_path))
+            objects[child_path] = new_child
+
+    deleted = []
+    for prev_child in prev_children:
+        if prev_child.name in nested:
+            deleted.extend(nested[prev_child.name])
+        elif prev_child.name not in new_names and prev_child.name not in renamed:
+            child_path = os.path.join(path, prev_child.name)
+            deleted.append(('-', child_path))
+            objects[child_path] = prev_child
+    return deleted
+
+
+def diff_trees(prev_tree, new_tree, sparse_patterns=None):
+    '''
+    Список изменений, превращающих prev_tree в new_tree
+    :param sparse_patterns: шаблоны выборки - изменения вне выборки не учитываются
+    '''
+    changes = []
+    if prev_tree.hash == new_tree.hash:
+        return changes
+    if prev_tree.name != new_tree.name:
+        changes.append(('?', prev_tree.name, '>', new_tree.name))
+    if content_hash(prev_tree) == content_hash(new_tree):
+        return changes
+    objects = {}
+    changes.extend(diff_folder(prev_tree, new_tree, str(new_tree.name), changes, objects, sparse_patterns))
+    return find_renames(changes, objects)
+
+
+def content_key(obj):
+    '''
+    Ключ для поиска одинаковых объектов по всему проекту или None для пустых файлов и папок,
+    которые совпадают со слишком многими
+    '''
+    key = content_hash(obj)
+    if key in ('', EMPTY_BLOB_HASH):
+        return None
+    return isinstance(obj, Tree), key
+
+
+def has_size_match(size, sizes, threshold):
+    '''
+    Есть ли в отсортированном списке sizes размер, с которым файл размера size может быть похож
+    (от size * threshold до size / threshold)
+    '''
+    i = bisect.bisect_left(sizes, size * threshold)
+    return i < len(sizes) and sizes[i] * threshold <= size
+
+
+def find_similar(sources, targets):
+    '''
+    Пары похожих файлов
+    :param sources: пути и объекты удаленных и измененных файлов
+    :param targets: пути и объекты добавленных файлов
+    :return: список (сходство, номер в targets, номер в sources) по убыванию сходства
+    '''
+    threshold = int(get_setting('DIFF', 'rename_threshold')) / 100
+    limit = int(get_setting('DIFF', 'rename_limit'))
+    max_size = int(get_setting('DIFF', 'rename_max_size'))
+    if not limit or not sources or not targets:
+        return []
+    # размеры известны без чтения содержимого (из индекса или заголовка блоба): файлы, которым не с чем
+    # совпасть по размеру, и слишком большие файлы не читаем
+    source_sizes = [obj.size for _, obj in sources]
+    target_sizes = [obj.size for _, obj in targets]
+    sorted_sources = sorted(size for size in source_sizes if size <= max_size)
+    sorted_targets = sorted(size for size in target_sizes if size <= max_size)
+    source_sketches = {}
+    for i, (_, obj) in enumerate(sources):
+        if source_sizes[i] <= max_size and has_size_match(source_sizes[i], sorted_targets, threshold):
+            source_sketches[i] = similarity.sketch(obj.iter_content())
+    # файлы-кандидаты - с общими значениями отпечатка, без перебора всех пар
+    by_line = {}
+    for i, source_sketch in source_sketches.items():
+        for line_hash in source_sketch:
+            by_line.setdefault(line_hash, []).append(i)
+    target_sketches = {}
+    candidates = []     # не больше limit пар (число общих значений отпечатка, номер в targets, номер в sources)
+    for j, (_, obj) in enumerate(targets):
+        size = target_sizes[j]
+        if size > max_size or not has_size_match(size, sorted_sources, threshold):
+            continue
+        target_sketch = similarity.sketch(obj.iter_content())
+        target_sketches[j] = target_sketch
+        shared = Counter(i for line_hash in target_sketch for i in by_line.get(line_hash, ()))
+        for i, count in shared.items():
+            # файлы слишком разного размера не могут быть похожи
+            if min(size, source_sizes[i]) >= threshold * max(size, source_sizes[i]):
+                if len(candidates) < limit:
+                    heapq.heappush(candidates, (count, j, i))
+                else:
+                    heapq.heappushpop(candidates, (count, j, i))
+    pairs = []
+    for _, j, i in candidates:
+        score = similarity.similarity(source_sketches[i], target_sketches[j])
+        if score >= threshold:
+            pairs.append((score, j, i))
+    pairs.sort(key=lambda pair: (-pair[0], pair[1], pair[2]))
+    return pairs
+
+
+def find_renames(changes, objects):
+    '''
+    Ищет по всему проекту переименования и копии среди добавленных и удаленных объектов:
+    сначала объекты с одинаковым содержимым, затем похожие файлы
+    Удаленный файл может быть переименован только один раз, остальные совпадения с ним и с измененными файлами - копии
+    :param objects: путь -> объект для добавлений и удалений, для изменений файлов - предыдущая версия
+    :return: changes, в котором добавления заменены переименованиями и копиями
+    '''
+    added = [change[1] for change in changes if change[0] == '+' and len(change) == 2]
+    deleted = [change[1] for change in changes if change[0] == '-']
+    if not added or not deleted and not any(change[0] == '?' and len(change) == 2 for change in changes):
+        return changes
+    found = {}      # путь добавления -> переименование или копия
+    renamed = set()     # пути удалений, ставших переименованиями
+
+    by_content = {}
+    for path in deleted:
+        key = content_key(objects[path])
+        if key is not None:
+            by_content.setdefault(key, []).append(path)
+    for path in added:
+        candidates = by_content.get(content_key(objects[path]))
+        if candidates:
+            source = candidates.pop(0)
+            found[path] = ('?', source, '>', path)
+            renamed.add(source)
+
+    sources = [(path, objects[path]) for path in deleted if path not in renamed and isinstance(objects[path], File)]
+    sources += [(change[1], objects[change[1]]) for change in changes
+                if change[0] == '?' and len(change) == 2 and change[1] in objects]
+    targets = [(path, objects[path]) for path in added if path not in found and isinstance(objects[path], File)]
+    deleted = set(deleted)
+    for score, j, i in find_similar(sources, targets):
+        path, source = targets[j][0], sources[i][0]
+        if path in found:
+            continue
+        if source in deleted and source not in renamed:
+            found[path] = ('?', source, '>', path)
+            renamed.add(source)
+        else:
+            found[path] = ('+', path, '<', source)
+
+    result = []
+    for change in changes:
+        if change[0] == '-' and change[1] in renamed:
+            continue
+        if change[0] == '+' and len(change) == 2:
+            change = found.get(change[1], change)
+        result.append(change)
+    return result
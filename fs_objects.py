@@ -1,15 +1,58 @@
 import hashlib
+import io
 import os
 import pickle
+import struct
 from pathlib import Path
 from typing import Union
 
-from config import DATA_FOLDER
+import chunking
+import storage
+from config import get_setting
 
 '''
 Классы описывающие объекты файловой системы
+
+Объекты хранятся в двоичном формате: заголовок OBJECT_HEADER (сигнатура, версия формата, тип объекта),
+затем поля объекта, упакованные через struct, и сырые байты (имена, содержимое блоба).
+Объекты, сохраненные старыми версиями через pickle, читаются через LegacyUnpickler
 '''
 
+OBJECT_MAGIC = b'VCSO'
+OBJECT_VERSION = 1
+OBJECT_HEADER = struct.Struct('>4sBB')      # сигнатура, версия, тип объекта
+BLOB, FILE, TREE, COMMIT = 1, 2, 3, 4       # типы объектов
+BLOB_HEADER = struct.Struct('>BQ')          # блоб хранится по частям?, размер содержимого
+COUNT = struct.Struct('>I')
+TREE_ENTRY = struct.Struct('>B20sH')        # тип, хэш, длина имени дочернего объекта
+COMMIT_HEADER = struct.Struct('>20sB')      # хэш дерева, есть ли родитель
+HASH_SIZE = 20
+
+# размер куска, которым читаются и сохраняются большие файлы
+CHUNK_SIZE = int(get_setting('STORAGE', 'chunk_size'))
+# способ разбиения больших файлов: fixed - куски по CHUNK_SIZE, cdc - границы по содержимому
+CHUNKING = get_setting('STORAGE', 'chunking')
+CDC_AVG_SIZE = int(get_setting('STORAGE', 'cdc_avg_size'))
+
+
+def read_chunks(path, size=None):
+    '''
+    Читает файл кусками по size байт
+    '''
+    if size is None:
+        size = CHUNK_SIZE
+    with open(path, mode='rb') as file:
+        while True:
+            chunk = file.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def object_header(obj_type):
+    return OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, obj_type)
+
+
 def get_sha1_hash(data: bytes) -> str:
     # Создаем объект хэша SHA-1
     sha1_hash = hashlib.sha1()
@@ -25,88 +68,337 @@ class Blob:
     Класс для хранения двоичных данных файлов
     Блобов может быть меньше чем файлов, если в проекте есть файлы с одинаковым содержимым
     В этом случае их хэш будет одинаков, и файл блоба будет общий
+
+    Большие файлы (больше CHUNK_SIZE) не держим в памяти: хэш считается потоково,
+    при сохранении файл читается кусками, каждый кусок сохраняется отдельным блобом,
+    а сам блоб хранит только список хэшей кусков (chunks).
+    В режиме chunking = cdc границы кусков определяются содержимым (см. chunking.py),
+    и изменение части файла сохраняет только затронутые куски
     '''
+    chunks = None   # хэши кусков, если блоб хранится по частям
+    source = None   # путь к файлу, из которого блоб будет прочитан при сохранении
 
     def __init__(self, content):
         self.content = content
         self.hash = get_sha1_hash(content)
+        self.size = len(content)
+
+    @classmethod
+    def from_file(cls, path):
+        '''
+        Создает блоб файла, не загружая его содержимое в память
+        '''
+        blob = cls.__new__(cls)
+        sha1_hash = hashlib.sha1()
+        blob.size = 0
+        for chunk in read_chunks(path):
+            sha1_hash.update(chunk)
+            blob.size += len(chunk)
+        blob.content = None
+        blob.hash = sha1_hash.hexdigest()
+        blob.source = path
+        return blob
 
     def save(self, path):
         '''
         Сохраняем объект в бинарном файле
         '''
 
-        if self.hash in os.listdir(DATA_FOLDER):
+        if storage.object_exists(self.hash):
             # такой объект уже есть в предыдущих коммитах, не сохраняем
             return
 
+        if self.source is None:
+            storage.write_object(self.hash, self.serialize())
+            return
+
+        # читаем файл кусками, проверяя что он не изменился после подсчета хэша
+        sha1_hash = hashlib.sha1()
+        if self.size <= CHUNK_SIZE:
+            with open(self.source, mode='rb') as file:
+                self.content = file.read()
+            sha1_hash.update(self.content)
+        else:
+            self.chunks = []
+            if CHUNKING == 'cdc':
+                chunks = chunking.iter_cdc_chunks(self.source, CDC_AVG_SIZE)
+            else:
+                chunks = read_chunks(self.source)
+            for chunk in chunks:
+                sha1_hash.update(chunk)
+                chunk_blob = Blob(chunk)
+                chunk_blob.save(path)
+                self.chunks.append(chunk_blob.hash)
+        if sha1_hash.hexdigest() != self.hash:
+            raise Exception(f'Файл {self.source} изменился во время сохранения')
+
         # сохраняем объект
-        with open(os.path.join(path, self.hash), 'wb') as file:
-            pickle.dump(self, file)
+        storage.write_object(self.hash, self.serialize())
+        # содержимое сохранено, больше не держим его в памяти
+        self.content = None
+        self.chunks = None
+
+    def __setstate__(self, state):
+        # старые объекты (pickle) не хранят размер содержимого
+        self.__dict__.update(state)
+        if 'size' not in state and self.content is not None:
+            self.size = len(self.content)
+
+    def serialize(self):
+        if self.chunks is not None:
+            hashes = b''.join(bytes.fromhex(chunk_hash) for chunk_hash in self.chunks)
+            return object_header(BLOB) + BLOB_HEADER.pack(1, self.size) + COUNT.pack(len(self.chunks)) + hashes
+        return object_header(BLOB) + BLOB_HEADER.pack(0, self.size) + self.content
+
+    @classmethod
+    def deserialize(cls, obj_hash, data: memoryview, offset):
+        '''
+        Содержимое блоба возвращается как memoryview на прочитанные байты, без копирования
+        '''
+        blob = cls.__new__(cls)
+        blob.hash = obj_hash
+        chunked, blob.size = BLOB_HEADER.unpack_from(data, offset)
+        offset += BLOB_HEADER.size
+        if chunked:
+            count, = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+            blob.chunks = [data[offset + i * HASH_SIZE:offset + (i + 1) * HASH_SIZE].hex() for i in range(count)]
+            blob.content = None
+        else:
+            blob.content = data[offset:]
+        return blob
+
+    def iter_content(self):
+        '''
+        Возвращает содержимое блоба по частям
+        '''
+        if self.content is not None:
+            yield self.content
+        elif self.chunks is not None:
+            for chunk_hash in self.chunks:
+                yield load(chunk_hash).content
+        elif self.source is not None:
+            yield from read_chunks(self.source)
+
+    def write_to(self, file):
+        '''
+        Записывает содержимое блоба в открытый файл, не загружая его целиком
+        '''
+        for chunk in self.iter_content():
+            file.write(chunk)
 
 
 class File:
     '''
     Класс для хранения данных о файле
+    Файл, загруженный из хранилища, читает свою запись (хэш блоба) и блоб только при обращении к ним
     '''
+    _blob = None    # блоб, его хэш или None, если запись файла еще не прочитана
 
     def __init__(self, name: Path):
         self.name = name
         if os.path.exists(name) and os.path.isfile(name):
-            with open(self.name, mode='rb') as file:
-                file_content = file.read()
-            self.blob = Blob(file_content)
+            self.blob = Blob.from_file(self.name)
             self.name = self.name.name
             self.hash = get_sha1_hash((str(self.name) + self.blob.hash).encode('utf-8'))
         else:
             raise FileNotFoundError(f"File '{name}' does not exist.")
 
+    @classmethod
+    def from_walk(cls, path, name):
+        '''
+        Файл, найденный при обходе папки: тип уже известен, поэтому путь повторно не проверяется
+        :param path: путь к файлу
+        :param name: имя файла
+        '''
+        file = cls.__new__(cls)
+        file.blob = Blob.from_file(path)
+        file.name = name
+        file.hash = get_sha1_hash((name + file.blob.hash).encode('utf-8'))
+        return file
+
+    @classmethod
+    def from_index(cls, path, name, blob_hash, size):
+        '''
+        Файл рабочей папки, хэш содержимого которого известен из индекса (файл не читается)
+        Если блоба еще нет в хранилище, он будет прочитан из файла при сохранении
+        '''
+        blob = Blob.__new__(Blob)
+        blob.content = None
+        blob.hash = blob_hash
+        blob.size = size
+        blob.source = path
+        file = cls.__new__(cls)
+        file.blob = blob
+        file.name = name
+        file.hash = get_sha1_hash((name + blob_hash).encode('utf-8'))
+        return file
+
+    @property
+    def blob(self):
+        if not isinstance(self._blob, Blob):
+            # блоб загружаем при первом обращении
+            self._blob = load(self.blob_hash)
+        return self._blob
+
+    @blob.setter
+    def blob(self, blob):
+        self._blob = blob
+
+    @property
+    def blob_hash(self):
+        if self._blob is None:
+            # запись файла еще не прочитана (файл - дочерний элемент загруженного дерева)
+            self._blob = load(self.hash)._blob
+        # до загрузки блоба хранится его хэш
+        return self._blob if isinstance(self._blob, str) else self._blob.hash
+
+    @property
+    def size(self):
+        '''
+        Размер содержимого: если блоб еще не загружен, читается только его заголовок
+        '''
+        if isinstance(self._blob, Blob):
+            return self._blob.size
+        return blob_size(self.blob_hash)
+
+    def iter_content(self):
+        '''
+        Содержимое файла по частям. Загруженный для этого блоб не запоминается в файле,
+        чтобы содержимое не оставалось в памяти вместе с деревом
+        '''
+        blob = self._blob if isinstance(self._blob, Blob) else load(self.blob_hash)
+        return blob.iter_content()
+
+    def __setstate__(self, state):
+        # старые объекты (pickle) хранят хэш блоба в атрибуте blob
+        if 'blob' in state:
+            state = dict(state)
+            state['_blob'] = state.pop('blob')
+        self.__dict__.update(state)
+
     def save(self, path):
         '''
-        Сохраняем файл в бинарном файле, заменяя блоб его хэшем
+        Сохраняем файл в бинарном файле, вместо блоба записываем его хэш
         Блоб сохраняем как отдельный файл
         '''
 
-        if self.hash in os.listdir(DATA_FOLDER):
+        if storage.object_exists(self.hash):
             # такой объект уже есть в предыдущих коммитах, не сохраняем
             return
 
         # сохраняем объект
         self.blob.save(path)
-        self.blob = self.blob.hash
-        with open(os.path.join(path, self.hash), 'wb') as file:
-            pickle.dump(self, file)
+        storage.write_object(self.hash, self.serialize())
 
-    def load(self):
+    def serialize(self):
+        return object_header(FILE) + bytes.fromhex(self.blob_hash) + str(self.name).encode('utf-8')
+
+    @classmethod
+    def deserialize(cls, obj_hash, data: memoryview, offset):
+        file = cls.__new__(cls)
+        file.hash = obj_hash
+        file.blob = data[offset:offset + HASH_SIZE].hex()
+        file.name = str(data[offset + HASH_SIZE:], 'utf-8')
+        return file
+
+    @classmethod
+    def stub(cls, name, obj_hash):
         '''
-        Загружаем блоб из файловой системы
-        :return:
+        Файл из хранилища, который еще не загружен (известны только имя и хэш)
         '''
-        blob_path = os.path.join(DATA_FOLDER, self.blob)
-        if not os.path.exists(blob_path):
-            raise Exception(f'Нет такого элемента {self.blob}')
-        self.blob = load(blob_path)
+        file = cls.__new__(cls)
+        file.name = name
+        file.hash = obj_hash
+        return file
 
 
 class Tree:
+    '''
+    Дерево (папка) проекта
+    Дерево, загруженное из хранилища, знает свой хэш и записи (тип, имя, хэш) дочерних объектов,
+    а сами дочерние объекты создает при первом обращении к children.
+    Дочерние деревья при этом загружаются только тогда, когда запрашивают уже их children
+
+    Хэш дерева считается один раз и запоминается в _hash. При изменении состава дерева (add_child)
+    запомненный хэш сбрасывается у самого дерева и у всех деревьев выше него
+    '''
+    _entries = None     # записи дочерних объектов загруженного дерева
+    _parent = None      # дерево, в которое добавлено это дерево
+
     def __init__(self, name: Path):
         self.name = name
         if os.path.exists(name) and os.path.isdir(name):
-            self.children = []
+            self._children = []
             self._hash = None
             self.name = self.name.name
         else:
             raise FileNotFoundError(f"Directory '{name}' does not exist.")
 
+    @classmethod
+    def from_walk(cls, name):
+        '''
+        Пустое дерево папки, найденной при обходе (путь повторно не проверяется)
+        '''
+        tree = cls.__new__(cls)
+        tree.name = name
+        tree._children = []
+        tree._hash = None
+        return tree
+
+    @classmethod
+    def stub(cls, name, obj_hash):
+        '''
+        Дерево из хранилища, которое еще не загружено (известны только имя и хэш)
+        '''
+        tree = cls.__new__(cls)
+        tree.name = name
+        tree._hash = obj_hash
+        tree._children = None
+        return tree
+
+    def __setstate__(self, state):
+        # старые объекты (pickle) хранят список хэшей дочерних объектов без их типов и имен
+        if 'children' in state:
+            state = dict(state)
+            state['_entries'] = [(None, None, child_hash) for child_hash in state.pop('children')]
+            state['_children'] = None
+        self.__dict__.update(state)
+
+    @property
+    def children(self):
+        if self._children is None:
+            if self._entries is None:
+                self._entries = load(self._hash)._entries
+            self._children = [make_stub(*entry) for entry in self._entries]
+            for child in self._children:
+                if isinstance(child, Tree):
+                    child._parent = self
+        return self._children
+
     def add_child(self, child: Union[File, 'Tree']):
         self.children.append(child)
+        if isinstance(child, Tree):
+            child._parent = self
+        self.invalidate_hash()
+
+    def invalidate_hash(self):
+        '''
+        Сбрасывает запомненный хэш дерева и деревьев, в которые оно входит
+        '''
+        tree = self
+        while tree is not None and tree._hash is not None:
+            tree._hash = None
+            tree = tree._parent
 
     @property
     def hash(self):
-        data = str(self.name)
-        for child in self.children:
-            data += child.hash
-        return get_sha1_hash(data.encode('utf-8'))
+        if self._hash is None:
+            data = str(self.name)
+            for child in self.children:
+                data += child.hash
+            self._hash = get_sha1_hash(data.encode('utf-8'))
+        return self._hash
 
     def print_tree(self):
         def iterate_tree(node, level=0):
@@ -129,38 +421,55 @@ class Tree:
 
     def save(self, path):
         '''
-        Сохраняем дерево в бинарном файле, элементы дерева заменяем хэшами
-        и сохраняем как отдельные файлы.
+        Сохраняем дерево в бинарном файле, вместо элементов дерева записываем их хэши,
+        а сами элементы сохраняем как отдельные объекты.
         Сохраняем только если такого хэша еще не было в пред коммитах
 
         :param path: путь к папке куда сохранять
         :return:
         '''
-        hash = self.hash  # хэш меняется после изменения self.children
+        hash = self.hash
 
-        if hash in os.listdir(DATA_FOLDER):
+        if storage.object_exists(hash):
             # такой объект уже есть в предыдущих коммитах, не сохраняем
             return
 
         # сохраняем дерево
-        for i in range(len(self.children)):
-            child_hash = self.children[i].hash
-            self.children[i].save(path)
-            self.children[i] = child_hash
-        with open(os.path.join(path, hash), 'wb') as file:
-            pickle.dump(self, file)
+        for child in self.children:
+            child.save(path)
+        storage.write_object(hash, self.serialize())
 
-    def load(self):
+    def serialize(self):
         '''
-        Загружаем компоненты дерева из файловой системы (деревья, файлы и тд)
-        :return:
+        Кроме хэшей дочерних объектов записываем их тип и имя,
+        чтобы содержимое папки было известно без загрузки дочерних объектов
         '''
-        for i in range(len(self.children)):
-            child_path = os.path.join(DATA_FOLDER, self.children[i])
-            if not os.path.exists(child_path):
-                raise Exception(f'Нет такого элемента {self.children[i]}')
-            self.children[i] = load(child_path)
-            self.children[i].load()
+        name = str(self.name).encode('utf-8')
+        data = [object_header(TREE), COUNT.pack(len(name)), name, COUNT.pack(len(self.children))]
+        for child in self.children:
+            child_name = str(child.name).encode('utf-8')
+            child_type = TREE if isinstance(child, Tree) else FILE
+            data.append(TREE_ENTRY.pack(child_type, bytes.fromhex(child.hash), len(child_name)))
+            data.append(child_name)
+        return b''.join(data)
+
+    @classmethod
+    def deserialize(cls, obj_hash, data: memoryview, offset):
+        tree = cls.stub(None, obj_hash)
+        name_size, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        tree.name = str(data[offset:offset + name_size], 'utf-8')
+        offset += name_size
+        count, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        tree._entries = []
+        for i in range(count):
+            child_type, child_hash, child_name_size = TREE_ENTRY.unpack_from(data, offset)
+            offset += TREE_ENTRY.size
+            child_name = str(data[offset:offset + child_name_size], 'utf-8')
+            offset += child_name_size
+            tree._entries.append((child_type, child_name, child_hash.hex()))
+        return tree
 
 
 class Commit:
@@ -177,36 +486,106 @@ class Commit:
 
     def save(self, path):
         '''
-        Сохраняем объект в бинарном файле, заменяем дерево хэшем,
+        Сохраняем объект в бинарном файле, вместо дерева записываем его хэш,
         дерево сохраняем отдельным файлом
         '''
-        tree_hash = self.tree.hash
         self.tree.save(path)
-        self.tree = tree_hash
-        with open(os.path.join(path, self.hash), 'wb') as file:
-            pickle.dump(self, file)
+        storage.write_object(self.hash, self.serialize())
+
+    def serialize(self):
+        tree_hash = self.tree if isinstance(self.tree, str) else self.tree.hash
+        data = object_header(COMMIT) + COMMIT_HEADER.pack(bytes.fromhex(tree_hash), self.parent_hash is not None)
+        if self.parent_hash is not None:
+            data += bytes.fromhex(self.parent_hash)
+        return data
+
+    @classmethod
+    def deserialize(cls, obj_hash, data: memoryview, offset):
+        commit = cls.__new__(cls)
+        commit.hash = obj_hash
+        tree_hash, has_parent = COMMIT_HEADER.unpack_from(data, offset)
+        commit.tree = tree_hash.hex()
+        offset += COMMIT_HEADER.size
+        commit.parent_hash = data[offset:offset + HASH_SIZE].hex() if has_parent else None
+        return commit
 
     def load(self):
         '''
-        Загружаем компоненты коммита из файловой системы (деревья, файлы и тд)
+        Загружаем дерево коммита. Дочерние объекты дерева загружаются при обращении к ним
         :return:
         '''
         # Ищем дерево
-        tree_path = os.path.join(DATA_FOLDER, self.tree)
-        if not os.path.exists(tree_path):
+        if not storage.has_object(self.tree):
             raise Exception(f'Нет такого дерева {self.tree}')
 
-        self.tree = load(tree_path)
-        self.tree.load()
+        self.tree = load(self.tree)
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    '''
+    Загрузка объектов, сохраненных старыми версиями через pickle.
+    Разрешены только классы объектов репозитория, поэтому загрузка не может выполнить произвольный код
+    '''
+
+    def find_class(self, module, name):
+        if module == 'fs_objects' and name in OBJECT_TYPES.values():
+            return globals()[name]
+        raise pickle.UnpicklingError(f'Недопустимый класс в объекте: {module}.{name}')
+
+
+OBJECT_TYPES = {BLOB: 'Blob', FILE: 'File', TREE: 'Tree', COMMIT: 'Commit'}
+
+
+def make_stub(obj_type, name, obj_hash):
+    '''
+    Создает незагруженный дочерний объект дерева по его записи
+    '''
+    if obj_type == TREE:
+        return Tree.stub(name, obj_hash)
+    elif obj_type == FILE:
+        return File.stub(name, obj_hash)
+    # в старых деревьях тип и имя не записаны, загружаем сам объект
+    return load(obj_hash)
+
+
+def blob_size(blob_hash):
+    '''
+    Размер содержимого блоба по его заголовку, без распаковки содержимого
+    '''
+    header = storage.read_prefix(blob_hash, OBJECT_HEADER.size + BLOB_HEADER.size)
+    if header[:len(OBJECT_MAGIC)] != OBJECT_MAGIC:
+        return load(blob_hash).size     # старый объект (pickle)
+    chunked, size = BLOB_HEADER.unpack_from(header, OBJECT_HEADER.size)
+    return size
+
+
+def blob_chunks(blob_hash):
+    '''
+    Хэши кусков блоба, хранящегося по частям, или None. Содержимое обычного блоба не распаковывается:
+    читается только заголовок
+    '''
+    header = storage.read_prefix(blob_hash, OBJECT_HEADER.size + BLOB_HEADER.size)
+    if header[:len(OBJECT_MAGIC)] != OBJECT_MAGIC:
+        return load(blob_hash).chunks   # старый объект (pickle)
+    chunked, size = BLOB_HEADER.unpack_from(header, OBJECT_HEADER.size)
+    return load(blob_hash).chunks if chunked else None
 
 
-def load(filename):
+def load(obj_hash):
     '''
-    Загружаем объект из бинарного файла
+    Загружаем объект из хранилища (loose-файл или pack) по его хэшу
     '''
-    with open(filename, 'rb') as f:
-        loaded_obj = pickle.load(f)
-        return loaded_obj
+    data = storage.read_object(obj_hash)
+    if data[:len(OBJECT_MAGIC)] != OBJECT_MAGIC:
+        obj = LegacyUnpickler(io.BytesIO(data)).load()
+        if isinstance(obj, Tree):
+            obj._hash = obj_hash
+        return obj
+    magic, version, obj_type = OBJECT_HEADER.unpack_from(data)
+    if version != OBJECT_VERSION or obj_type not in OBJECT_TYPES:
+        raise Exception(f'Неизвестный формат объекта {obj_hash}')
+    cls = globals()[OBJECT_TYPES[obj_type]]
+    return cls.deserialize(obj_hash, memoryview(data), OBJECT_HEADER.size)
 
 
 if __name__ == '__main__':
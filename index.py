@@ -0,0 +1,131 @@
+import os
+
+from config import VCS_FOLDER, INDEX_PATH
+
+'''
+Индекс рабочей папки (аналог git index): путь файла -> (размер, mtime, inode, ctime) и хэш его блоба.
+Если stat файла совпадает с записью индекса, файл не читается и не хэшируется заново.
+Файл, измененный в тот же момент времени, когда был записан индекс, мог измениться уже после
+подсчета хэша, не изменив stat (racy clean) - таким записям не доверяем и хэшируем файл заново.
+Кроме файлов в индексе есть папки, записи идут в порядке обхода проекта - по ним восстанавливается
+содержимое папок, которые не изменялись (см. watcher.py).
+Индекс - текстовый файл, строка на файл: <хэш блоба> <размер> <mtime_ns> <inode> <ctime_ns> <путь>,
+у папок вместо хэша FOLDER. Первой строкой может идти сессия наблюдателя: watch <токен> <позиция в журнале>
+'''
+
+FOLDER = '-'
+
+_entries = None     # путь -> (stat, хэш блоба или FOLDER)
+_children = None    # путь папки -> [(имя, папка ли)] в порядке обхода
+_session = None     # (токен наблюдателя, позиция в журнале изменений) на момент прошлого обхода
+_index_mtime = 0    # время записи индекса (нс)
+_changed = False
+
+
+def stat_key(st):
+    return st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns
+
+
+def load_index():
+    '''
+    Читает индекс один раз за команду
+    '''
+    global _entries, _session, _index_mtime
+    if _entries is None:
+        _entries = {}
+        if INDEX_PATH.exists():
+            _index_mtime = os.stat(INDEX_PATH).st_mtime_ns
+            with open(INDEX_PATH, 'r', encoding='utf-8', errors='surrogateescape') as file:
+                for line in file:
+                    if line.startswith('watch '):
+                        _, token, offset = line.split()
+                        _session = (token, int(offset))
+                        continue
+                    blob_hash, size, mtime, ino, ctime, path = line.rstrip('\n').split(' ', 5)
+                    _entries[path] = ((int(size), int(mtime), int(ino), int(ctime)), blob_hash)
+    return _entries
+
+
+def session():
+    load_index()
+    return _session
+
+
+def lookup(path, st):
+    '''
+    Хэш блоба файла, если его stat совпадает с индексом, иначе None
+    :param path: путь относительно корня проекта
+    '''
+    entry = load_index().get(path)
+    if entry is None or entry[0] != stat_key(st) or st.st_mtime_ns >= _index_mtime:
+        return None
+    return entry[1]
+
+
+def entry(path):
+    '''
+    Запись индекса ((размер, mtime, inode, ctime), хэш блоба) без проверки stat
+    '''
+    return load_index()[path]
+
+
+def is_folder(path):
+    found = load_index().get(path)
+    return found is not None and found[1] == FOLDER
+
+
+def children(path):
+    '''
+    Содержимое папки в порядке прошлого обхода: список (имя, папка ли)
+    '''
+    global _children
+    if _children is None:
+        _children = {}
+        for child_path, (_, blob_hash) in load_index().items():
+            if child_path != '.':
+                parent, name = os.path.split(child_path)
+                _children.setdefault(parent or '.', []).append((name, blob_hash == FOLDER))
+    return _children.get(path, [])
+
+
+def update(path, st, blob_hash):
+    global _changed
+    key = stat_key(st)
+    entries = load_index()
+    # racy-запись переписываем, даже если она не изменилась: индекс получит более позднее время записи
+    if entries.get(path) != (key, blob_hash) or st.st_mtime_ns >= _index_mtime:
+        entries[path] = (key, blob_hash)
+        _changed = True
+
+
+def add_folder(path):
+    global _changed
+    entries = load_index()
+    if path not in entries:
+        entries[path] = ((0, 0, 0, 0), FOLDER)
+        _changed = True
+
+
+def save_index(paths, new_session=None):
+    '''
+    Записывает индекс, оставляя в нем только пути paths (файлы и папки в порядке обхода)
+    Индекс - только кэш, поэтому пишем его без fsync: при сбое файлы будут просто прохешированы заново
+    :param new_session: сессия наблюдателя на момент начала обхода
+    '''
+    global _entries, _changed, _children, _session
+    entries = load_index()
+    if not VCS_FOLDER.exists() or (not _changed and len(entries) == len(paths) and new_session == _session):
+        return
+    tmp_path = str(INDEX_PATH) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape') as file:
+        if new_session is not None:
+            file.write(f'watch {new_session[0]} {new_session[1]}\n')
+        for path in paths:
+            key, blob_hash = entries[path]
+            if '\n' not in path:
+                file.write(f'{blob_hash} {key[0]} {key[1]} {key[2]} {key[3]} {path}\n')
+    os.replace(tmp_path, INDEX_PATH)
+    _entries = {path: entries[path] for path in paths}
+    _children = None
+    _session = new_session
+    _changed = False
@@ -2,7 +2,6 @@ import sys
 import textwrap
 
 import crypto
-import server_api
 from commands import *
 from translate import commands_dict, phrase
 
@@ -57,6 +56,7 @@ def main(args):
             link = args[2].split('/')
             username = link[-3]
             repository_name = link[-2]
+            import server_api   # requests загружается только для команд сервера
             server_api.download_and_extract_zip(username, repository_name)
         else:
             print(f"{phrase['Нужно указать ссылку на скачиваемый репозиторий'][lang]}\n"
@@ -85,13 +85,29 @@ def main(args):
         commit = make_commit(print_content=False)
         save_commit(commit)
         if len(args) < 4:
-            restore_commit(args[2])
+            # файлы, совпадающие с восстанавливаемым коммитом, не перезаписываются
+            restore_commit(args[2], current_tree=commit.tree)
         else:
             restore_commit(args[2], args[3])
         return
     elif cmd == 'hist':
         commit_history(False)
         return
+    elif cmd == 'repack':
+        repack()
+        return
+    elif cmd == 'migrate':
+        migrate()
+        return
+    elif cmd == 'gc':
+        gc()
+        return
+    elif cmd == 'watch':
+        watch()
+        return
+    elif cmd == 'sparse':
+        sparse_checkout(args[2:])
+        return
     elif cmd == 'status':
         changes_list = status()
         for change in changes_list:
@@ -142,6 +158,7 @@ def main(args):
             print(f"{phrase['Нужно указать токен для загрузки репозитория на сервер'][lang]}\n"
                   f"{phrase['Пример'][lang]}: vcs token <token>")
             return
+        import server_api
         server_api.send_files(f'http://127.0.0.1:8000/{username}/{repository_name}/upload', token)
         return
     elif cmd == 'remote':
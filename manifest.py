@@ -0,0 +1,115 @@
+import os
+
+from config import MANIFEST_FOLDER
+from fs_objects import File, Tree, get_sha1_hash
+
+'''
+Манифест коммита: плоский список всех файлов и папок дерева коммита, отсортированный по пути.
+Пишется при сохранении коммита в MANIFEST_FOLDER/<хэш коммита> и читается одним последовательным чтением,
+поэтому сравнение с коммитом (status, откат) не загружает из хранилища ни деревья, ни записи файлов, ни блобы.
+Манифест - только кэш: если его нет (коммит сохранен старой версией) или он поврежден,
+дерево коммита загружается из хранилища.
+
+Формат: первая строка - manifest <число записей> <имя корневой папки>,
+затем строка на объект: <хэш> <тип> <путь относительно корня через '/'>,
+у файла тип FILE и хэш блоба, у папки - FOLDER и хэш дерева (у корня путь '.')
+'''
+
+FILE, FOLDER = 'f', 'd'
+
+
+def manifest_path(commit_hash):
+    return os.path.join(MANIFEST_FOLDER, commit_hash)
+
+
+def iter_entries(tree, prefix='', base=None):
+    '''
+    Записи (путь, тип, хэш) объектов дерева
+    :param base: та же папка в дереве, построенном по манифесту предыдущего коммита: совпавшие поддеревья
+        и файлы берутся из него, не загружаясь из хранилища (например, перенесенные из HEAD в режиме выборки)
+    '''
+    base_children = {child.name: child for child in base.children} if base is not None else {}
+    for child in tree.children:
+        path = prefix + child.name
+        base_child = base_children.get(child.name)
+        if isinstance(child, Tree):
+            yield path, FOLDER, child.hash
+            if not isinstance(base_child, Tree):
+                yield from iter_entries(child, path + '/')
+            elif base_child.hash == child.hash:
+                yield from iter_entries(base_child, path + '/')
+            else:
+                yield from iter_entries(child, path + '/', base_child)
+        elif isinstance(base_child, File) and base_child.hash == child.hash:
+            yield path, FILE, base_child.blob_hash
+        else:
+            yield path, FILE, child.blob_hash
+
+
+def write_manifest(commit_hash, tree, base=None):
+    '''
+    Записывает манифест коммита. Как и индекс, пишется без fsync: после сбоя дерево будет прочитано из хранилища
+    :param base: дерево предыдущего коммита, построенное по манифесту (см. iter_entries)
+    '''
+    entries = sorted(iter_entries(tree, base=base))
+    if any('\n' in path for path, _, _ in entries) or '\n' in str(tree.name):
+        return
+    os.makedirs(MANIFEST_FOLDER, exist_ok=True)
+    path = manifest_path(commit_hash)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape') as file:
+        file.write(f'manifest {len(entries) + 1} {tree.name}\n')
+        file.write(f'{tree.hash} {FOLDER} .\n')
+        for entry_path, entry_type, entry_hash in entries:
+            file.write(f'{entry_hash} {entry_type} {entry_path}\n')
+    os.replace(tmp_path, path)
+
+
+def load_manifest(commit_hash):
+    '''
+    Дерево коммита, построенное по манифесту: дочерние объекты известны сразу, файлы знают хэш блоба
+    :return: дерево или None, если манифеста нет
+    '''
+    try:
+        with open(manifest_path(commit_hash), 'r', encoding='utf-8', errors='surrogateescape') as file:
+            lines = file.read().split('\n')
+    except FileNotFoundError:
+        return None
+    try:
+        header, count, root_name = lines[0].split(' ', 2)
+        if header != 'manifest' or int(count) != len(lines) - 2 or lines[-1] != '':
+            return None
+        folders = {}
+        for line in lines[1:-1]:
+            entry_hash, entry_type, path = line.split(' ', 2)
+            parent, _, name = path.rpartition('/')
+            if entry_type == FOLDER:
+                tree = Tree.stub(name, entry_hash)
+                tree._children = []
+                folders[path] = tree
+                if path == '.':
+                    tree.name = root_name
+                    continue
+                child = tree
+            else:
+                child = File.stub(name, get_sha1_hash((name + entry_hash).encode('utf-8')))
+                child.blob = entry_hash
+            parent_tree = folders[parent or '.']
+            parent_tree._children.append(child)
+            if entry_type == FOLDER:
+                child._parent = parent_tree
+    except (ValueError, KeyError):
+        return None
+    return folders['.']
+
+
+def remove_manifests(reachable, expire):
+    '''
+    Удаляет манифесты коммитов, удаленных сборкой мусора
+    '''
+    if not os.path.isdir(MANIFEST_FOLDER):
+        return
+    for name in os.listdir(MANIFEST_FOLDER):
+        path = os.path.join(MANIFEST_FOLDER, name)
+        if name not in reachable and os.path.getmtime(path) < expire:
+            os.remove(path)
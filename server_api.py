@@ -9,6 +9,7 @@ import os
 
 import commands
 from config import BASE_PATH
+from walker import Walker
 from translate import phrase
 
 
@@ -63,12 +64,17 @@ def send_file(filepath, url, token):
 
 
 def send_files(url, token, path=BASE_PATH):
-    tree = commands.iter_folder(path=BASE_PATH, print_content=False)
-    filenames = list(tree.get_filenames())
+    # файлы проекта без игнорируемых и временных (хэшировать их для отправки не нужно)
+    filenames = []
+    for entry in Walker(path):
+        if '~$' in entry.path:
+            entry.skip = True
+        elif not entry.is_folder:
+            filenames.append(entry.path)
     total_tasks = len(filenames)
     start_time = datetime.datetime.now()
     for i in range(total_tasks):
-        full_path = os.path.join(BASE_PATH.parent, filenames[i])
+        full_path = filenames[i]
         try:
             send_file(full_path, url, token)
         except Exception as e:
@@ -0,0 +1,68 @@
+import heapq
+import zlib
+
+'''
+Оценка сходства файлов по содержимому (MinHash в варианте bottom-k).
+Файл разбивается на строки (концевые пробелы и пустые строки не учитываются, длинные строки режутся
+на части по MAX_LINE байт), строка хэшируется crc32,
+а отпечатком (sketch) файла служат SKETCH_SIZE наименьших хэшей его строк.
+Сходство двух файлов - доля общих значений среди SKETCH_SIZE наименьших хэшей объединения отпечатков,
+это оценка коэффициента Жаккара для множеств строк. Отпечаток считается потоково, за один проход по файлу,
+и занимает фиксированный объем памяти независимо от размера файла.
+'''
+
+SKETCH_SIZE = 64
+# более длинные строки (и содержимое без переводов строк) режутся на части такой длины,
+# чтобы не держать в памяти всю строку
+MAX_LINE = 4096
+
+
+def sketch(chunks, size=SKETCH_SIZE):
+    '''
+    Отпечаток содержимого, заданного кусками (см. Blob.iter_content)
+    :return: множество не более чем size наименьших хэшей строк
+    '''
+    heap = []       # наибольший из выбранных хэшей - на вершине (хранятся со знаком минус)
+    selected = set()
+
+    def add_line(line):
+        for start in range(0, len(line), MAX_LINE):
+            add(line[start:start + MAX_LINE])
+
+    def add(line):
+        line = line.rstrip()
+        if not line:
+            return
+        line_hash = zlib.crc32(line)
+        if line_hash in selected:
+            return
+        if len(heap) < size:
+            heapq.heappush(heap, -line_hash)
+            selected.add(line_hash)
+        elif line_hash < -heap[0]:
+            selected.discard(-heapq.heapreplace(heap, -line_hash))
+            selected.add(line_hash)
+
+    tail = b''
+    for chunk in chunks:
+        lines = (tail + bytes(chunk)).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            add_line(line)
+        if len(tail) > MAX_LINE:
+            # от незаконченной строки оставляем только последнюю неполную часть
+            cut = len(tail) - len(tail) % MAX_LINE
+            add_line(tail[:cut])
+            tail = tail[cut:]
+    add_line(tail)
+    return frozenset(selected)
+
+
+def similarity(first, second, size=SKETCH_SIZE):
+    '''
+    Оценка сходства (от 0 до 1) по отпечаткам двух файлов
+    '''
+    if not first or not second:
+        return 0.0
+    union = heapq.nsmallest(size, first | second)
+    return sum(1 for line_hash in union if line_hash in first and line_hash in second) / len(union)
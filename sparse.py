@@ -0,0 +1,137 @@
+import fnmatch
+import os
+
+from config import SPARSE_PATH, GITIGNORE
+from fs_objects import Tree
+
+'''
+Выборочное восстановление (sparse checkout): в рабочей папке находятся и отслеживаются только пути,
+подходящие под шаблоны из SPARSE_PATH (строка на шаблон, путь от корня проекта через '/',
+в каждой части пути можно использовать шаблоны fnmatch: src/*/tests).
+Путь, подходящий под шаблон целиком, входит в выборку вместе со всем содержимым (INSIDE),
+папка, в которой есть подходящие пути, обходится (PARTIAL), остальное (OUTSIDE) не обходится,
+не восстанавливается и в коммит переносится без изменений из HEAD (см. graft), не загружаясь из хранилища.
+.gitignore обходимых папок (корня и PARTIAL) отслеживается всегда: его правила действуют и на пути из выборки.
+'''
+
+INSIDE, PARTIAL, OUTSIDE = 'inside', 'partial', 'outside'
+
+
+def split_path(path):
+    return [part for part in str(path).replace(os.sep, '/').split('/') if part and part != '.']
+
+
+class SparsePatterns:
+    def __init__(self, patterns):
+        self.patterns = [split_path(pattern) for pattern in patterns]
+
+    def state(self, rel_path):
+        '''
+        Входит ли путь (относительно корня проекта) в выборку: INSIDE, PARTIAL или OUTSIDE
+        '''
+        parts = split_path(rel_path)
+        result = OUTSIDE
+        for pattern in self.patterns:
+            common = min(len(parts), len(pattern))
+            if all(fnmatch.fnmatchcase(parts[i], pattern[i]) for i in range(common)):
+                if len(parts) >= len(pattern):
+                    return INSIDE
+                result = PARTIAL
+        return result
+
+
+_sparse = None
+_loaded = False
+
+
+def load_sparse():
+    '''
+    Шаблоны выборки или None, если выборочное восстановление выключено. Читаются один раз за команду
+    '''
+    global _sparse, _loaded
+    if not _loaded:
+        _loaded = True
+        patterns = []
+        if SPARSE_PATH.exists():
+            with open(SPARSE_PATH, 'r', encoding='utf-8') as file:
+                patterns = [line.strip() for line in file if line.strip() and not line.startswith('#')]
+        _sparse = SparsePatterns(patterns) if patterns else None
+    return _sparse
+
+
+def save_sparse(patterns):
+    '''
+    Записывает шаблоны выборки (пустой список - выключить выборочное восстановление)
+    '''
+    global _loaded
+    if patterns:
+        with open(SPARSE_PATH, 'w', encoding='utf-8') as file:
+            file.writelines(pattern + '\n' for pattern in patterns)
+    elif SPARSE_PATH.exists():
+        os.remove(SPARSE_PATH)
+    _loaded = False
+
+
+def state(sparse, rel_path):
+    return INSIDE if sparse is None else sparse.state(rel_path)
+
+
+def child_path(rel_path, name):
+    return name if rel_path == '.' else os.path.join(rel_path, name)
+
+
+def tracked(sparse, rel_path, is_folder):
+    '''
+    Отслеживается ли объект: файл - если входит в выборку или это .gitignore обходимой папки,
+    папка - если в ней есть что-то из выборки
+    '''
+    path_state = state(sparse, rel_path)
+    if path_state == INSIDE or is_folder and path_state == PARTIAL:
+        return True
+    if not is_folder and os.path.basename(rel_path) == GITIGNORE:
+        return state(sparse, os.path.dirname(rel_path) or '.') == PARTIAL
+    return False
+
+
+def graft(work_tree, head_tree, sparse, rel_path='.'):
+    '''
+    Дерево коммита в режиме выборки: отслеживаемое содержимое рабочей папки и объекты HEAD вне выборки,
+    которые переносятся как есть (их поддеревья не загружаются)
+    :param work_tree: папка из рабочей папки (см. iter_folder) или None, если ее нет на диске
+    :param head_tree: та же папка в HEAD или None
+    :return: новое дерево (work_tree не изменяется) или None, если папки нет на диске и переносить нечего
+    '''
+    work_children = work_tree.children if work_tree is not None else []
+    head_children = head_tree.children if head_tree is not None else []
+    head_by_name = {child.name: child for child in head_children}
+    work_names = {child.name for child in work_children}
+    # объекты из HEAD, которых нет в рабочей папке, ставим на их места в HEAD: сразу после
+    # предшествующего им в HEAD объекта рабочей папки (None - в начало папки)
+    inserted = {}
+    previous = None
+    for child in head_children:
+        if child.name in work_names:
+            previous = child.name
+            continue
+        path = child_path(rel_path, child.name)
+        is_folder = isinstance(child, Tree)
+        if is_folder and sparse.state(path) == PARTIAL:
+            child = graft(None, child, sparse, path)
+        elif tracked(sparse, path, is_folder):
+            child = None    # объект из выборки удален из рабочей папки
+        if child is not None:
+            inserted.setdefault(previous, []).append(child)
+    # объекты рабочей папки - в порядке обхода, как при обходе без выборки
+    children = inserted.get(None, [])
+    for child in work_children:
+        path = child_path(rel_path, child.name)
+        if isinstance(child, Tree) and sparse.state(path) == PARTIAL:
+            head_child = head_by_name.get(child.name)
+            child = graft(child, head_child if isinstance(head_child, Tree) else None, sparse, path)
+        children.append(child)
+        children.extend(inserted.get(child.name, []))
+    if work_tree is None and not children:
+        return None
+    tree = Tree.stub(work_tree.name if work_tree is not None else head_tree.name, None)
+    tree._children = children
+    return tree
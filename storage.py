@@ -0,0 +1,752 @@
+import hashlib
+import lzma
+import mmap
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+import delta
+from cache import LRUCache
+from config import DATA_FOLDER, PACK_FOLDER, OBJECTS_INDEX_PATH, OBJECT_TIMES_PATH, get_setting
+
+'''
+Хранилище объектов репозитория.
+Отдельные объекты пишутся "россыпью" (loose) - каждый в свой файл DATA_FOLDER/<первые 2 символа хэша>/<остальные>,
+чтобы в одной папке не было сотен тысяч файлов (старые репозитории переводятся на такую раскладку командой migrate).
+Объекты коммита пишутся пакетом (Batch) во временный pack-файл, который сбрасывается на диск одним fsync
+и публикуется переименованием - при сбое не остается частично записанных объектов.
+Pack - один файл данных (.pack) и отсортированный индекс хэш -> смещение (.idx),
+по которому объект ищется бинарным поиском. Периодически все объекты упаковываются в один pack.
+Наличие объекта проверяется по индексу существующих объектов (.vcs/objects) - множеству хэшей,
+которое читается один раз за команду и дополняется при записи новых объектов.
+Объекты сжимаются (zlib/lzma, см. compression в .vcs/config) и хранятся с заголовком
+COMPRESSED_MAGIC + кодек + уровень. Объекты без заголовка хранятся как есть.
+Большие объекты (loose-файлы и участки pack-файлов) читаются через mmap: несжатый объект возвращается
+как memoryview на отображенный участок файла, без копирования в память процесса.
+Отображение освобождается, когда на него больше нет ссылок.
+При упаковке похожие версии одного файла хранятся дельтой от соседней версии (DELTA_MAGIC + хэш базы
++ сжатая дельта, см. delta.py). Глубина цепочки дельт ограничена delta_depth.
+Время записи недостижимых объектов, переупакованных сборкой мусора до истечения gc_grace, хранится в OBJECT_TIMES_PATH.
+'''
+
+PACK_MAGIC = b'VPCK'
+INDEX_MAGIC = b'VIDX'
+PACK_VERSION = 1
+HEADER = struct.Struct('>4sII')     # сигнатура, версия, количество объектов
+INDEX_ENTRY = struct.Struct('>20sQQ')   # хэш (20 байт sha1), смещение в .pack, длина
+
+COMPRESSED_MAGIC = b'VCZ'
+COMPRESSED_HEADER = struct.Struct('>3sBB')  # сигнатура, кодек, уровень сжатия
+CODECS = {'zlib': 1, 'lzma': 2}
+MMAP_THRESHOLD = 65536  # loose-файлы от такого размера читаются через mmap
+SAMPLE_SIZE = 65536     # по такому началу объекта проверяем, сжимается ли он
+MIN_RATIO = 0.9         # если образец сжимается хуже - объект уже сжат (архив, картинка и тд)
+PREFIX_STEP = 4096      # такими порциями сжатые данные подаются на распаковку при чтении начала объекта
+
+DELTA_MAGIC = b'VCD'
+DELTA_PREFIX = struct.Struct('>3s20s')  # сигнатура, хэш базы
+DELTA_SIZE_RATIO = 2    # дельту строим только между версиями, размеры которых отличаются не больше чем в 2 раза
+
+
+def compress(data: bytes) -> bytes:
+    '''
+    Сжимает объект кодеком из настроек
+    Уже сжатые данные и данные, которые не уменьшаются при сжатии, возвращаются как есть
+    '''
+    codec = get_setting('STORAGE', 'compression')
+    if codec not in CODECS:
+        return data
+    level = int(get_setting('STORAGE', 'compression_level'))
+    if len(data) > SAMPLE_SIZE:
+        sample = data[:SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) > len(sample) * MIN_RATIO:
+            return data
+
+    if codec == 'zlib':
+        compressed = zlib.compress(data, level)
+    else:
+        compressed = lzma.compress(data, preset=level)
+    if len(compressed) + COMPRESSED_HEADER.size >= len(data):
+        return data
+    return COMPRESSED_HEADER.pack(COMPRESSED_MAGIC, CODECS[codec], level) + compressed
+
+
+def map_region(path, offset, length):
+    '''
+    Отображает участок файла в память
+    :return: memoryview на участок
+    '''
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with open(path, 'rb') as file:
+        region = mmap.mmap(file.fileno(), offset + length - start, access=mmap.ACCESS_READ, offset=start)
+    return memoryview(region)[offset - start:]
+
+
+def decompress(data):
+    '''
+    Распаковывает объект по заголовку. Объекты без заголовка (несжатые и старые) возвращаются как есть
+    :param data: bytes или memoryview
+    '''
+    if data[:len(COMPRESSED_MAGIC)] != COMPRESSED_MAGIC:
+        return data
+    magic, codec, level = COMPRESSED_HEADER.unpack_from(data)
+    if codec == CODECS['zlib']:
+        return zlib.decompress(data[COMPRESSED_HEADER.size:])
+    elif codec == CODECS['lzma']:
+        return lzma.decompress(data[COMPRESSED_HEADER.size:])
+    raise Exception(f'Неизвестный кодек сжатия {codec}')
+
+
+class Pack:
+    '''
+    Pack-файл с индексом. Индекс читается целиком один раз,
+    поиск объекта - бинарный поиск по записям фиксированной длины
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.pack_path = Path(os.path.join(PACK_FOLDER, name + '.pack'))
+        self.index_path = Path(os.path.join(PACK_FOLDER, name + '.idx'))
+        with open(self.index_path, 'rb') as file:
+            self.index = file.read()
+        magic, version, self.count = HEADER.unpack_from(self.index)
+        if magic != INDEX_MAGIC or version != PACK_VERSION:
+            raise Exception(f'Поврежден индекс {self.index_path}')
+        self._file = None
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.index, HEADER.size + i * INDEX_ENTRY.size)
+
+    def find(self, obj_hash):
+        '''
+        Ищет объект в индексе
+        :return: (смещение, длина) или None
+        '''
+        key = bytes.fromhex(obj_hash)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_hash, offset, length = self._entry(middle)
+            if entry_hash < key:
+                low = middle + 1
+            elif entry_hash > key:
+                high = middle
+            else:
+                return offset, length
+        return None
+
+    def hashes(self):
+        for i in range(self.count):
+            yield self._entry(i)[0].hex()
+
+    def delta_bases(self):
+        '''
+        Базы объектов, хранящихся в pack-файле дельтой (читаются только заголовки объектов)
+        :return: словарь хэш -> хэш базы
+        '''
+        bases = {}
+        if self._file is None:
+            self._file = open(self.pack_path, 'rb')
+        for i in range(self.count):
+            entry_hash, offset, length = self._entry(i)
+            if length < DELTA_PREFIX.size:
+                continue
+            self._file.seek(offset)
+            magic, base_hash = DELTA_PREFIX.unpack(self._file.read(DELTA_PREFIX.size))
+            if magic == DELTA_MAGIC:
+                bases[entry_hash.hex()] = base_hash.hex()
+        return bases
+
+    def read(self, obj_hash):
+        found = self.find(obj_hash)
+        if found is None:
+            return None
+        offset, length = found
+        if length >= MMAP_THRESHOLD:
+            return map_region(self.pack_path, offset, length)
+        if self._file is None:
+            self._file = open(self.pack_path, 'rb')
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_packs = None   # pack-файлы репозитория, загружаются один раз за команду
+# кэш распакованных объектов, общий для всех загрузок
+object_cache = LRUCache(int(get_setting('STORAGE', 'cache_size')))
+
+
+def get_packs():
+    global _packs
+    if _packs is None:
+        _packs = []
+        if PACK_FOLDER.exists():
+            for filename in sorted(os.listdir(PACK_FOLDER)):
+                if filename.endswith('.idx'):
+                    _packs.append(Pack(filename[:-len('.idx')]))
+    return _packs
+
+
+def close_packs():
+    '''
+    Закрывает pack-файлы (нужно перед их удалением/заменой)
+    '''
+    global _packs
+    if _packs is not None:
+        for pack in _packs:
+            pack.close()
+    _packs = None
+
+
+def loose_path(obj_hash):
+    return os.path.join(DATA_FOLDER, obj_hash[:2], obj_hash[2:])
+
+
+def is_hash(name):
+    return len(name) == 40 and all(c in '0123456789abcdef' for c in name)
+
+
+def loose_objects():
+    '''
+    loose-объекты хранилища
+    :return: словарь хэш -> путь к файлу
+    '''
+    objects = {}
+    if not DATA_FOLDER.exists():
+        return objects
+    for name in os.listdir(DATA_FOLDER):
+        path = os.path.join(DATA_FOLDER, name)
+        if len(name) == 2 and os.path.isdir(path):
+            for rest in os.listdir(path):
+                objects[name + rest] = os.path.join(path, rest)
+        elif is_hash(name):
+            # объект старой (плоской) раскладки, еще не перенесенный командой migrate
+            objects[name] = path
+    return objects
+
+
+def find_loose(obj_hash):
+    '''
+    Путь к loose-файлу объекта или None
+    '''
+    path = loose_path(obj_hash)
+    if os.path.exists(path):
+        return path
+    path = os.path.join(DATA_FOLDER, obj_hash)
+    if os.path.exists(path):
+        return path
+    return None
+
+
+def migrate_loose():
+    '''
+    Переносит loose-объекты из плоской раскладки в подпапки по первым двум символам хэша
+    :return: количество перенесенных объектов
+    '''
+    count = 0
+    for name in os.listdir(DATA_FOLDER):
+        path = os.path.join(DATA_FOLDER, name)
+        if is_hash(name) and os.path.isfile(path):
+            os.makedirs(os.path.dirname(loose_path(name)), exist_ok=True)
+            os.replace(path, loose_path(name))
+            count += 1
+    return count
+
+
+_known_objects = None    # множество хэшей всех объектов хранилища
+
+
+def rebuild_objects_index():
+    '''
+    Пересоздает индекс существующих объектов по loose-файлам и pack-файлам
+    '''
+    global _known_objects
+    _known_objects = set(loose_objects())
+    for pack in get_packs():
+        _known_objects.update(pack.hashes())
+    with open(OBJECTS_INDEX_PATH, 'w') as file:
+        file.writelines(obj_hash + '\n' for obj_hash in sorted(_known_objects))
+    return _known_objects
+
+
+def known_objects():
+    '''
+    Множество хэшей объектов хранилища, загружается один раз за команду
+    '''
+    global _known_objects
+    if _known_objects is None:
+        if OBJECTS_INDEX_PATH.exists():
+            with open(OBJECTS_INDEX_PATH, 'r') as file:
+                _known_objects = set(file.read().split())
+        else:
+            rebuild_objects_index()
+    return _known_objects
+
+
+def object_exists(obj_hash):
+    return obj_hash in known_objects()
+
+
+def has_object(obj_hash):
+    '''
+    То же, что object_exists, но при промахе индекса объект ищется в loose-файлах и pack-файлах
+    (запись в индекс могла не попасть на диск при сбое) - тогда индекс пересоздается
+    '''
+    if object_exists(obj_hash):
+        return True
+    if find_loose(obj_hash) is None and all(pack.find(obj_hash) is None for pack in get_packs()):
+        return False
+    rebuild_objects_index()
+    return True
+
+
+_read_lock = threading.Lock()   # pack-файлы читаются через общий дескриптор (seek + read)
+
+
+def read_stored(obj_hash):
+    '''
+    Возвращает байты объекта в том виде, в котором они хранятся (сначала ищем loose, потом в pack-файлах)
+    Может вызываться из нескольких потоков, распаковка выполняется уже вне блокировки
+    '''
+    with _read_lock:
+        return _read_stored(obj_hash)
+
+
+def _read_stored(obj_hash):
+    if _batch is not None:
+        data = _batch.read(obj_hash)
+        if data is not None:
+            return data
+    path = find_loose(obj_hash)
+    if path is not None:
+        size = os.path.getsize(path)
+        if size >= MMAP_THRESHOLD:
+            return map_region(path, 0, size)
+        with open(path, 'rb') as file:
+            return file.read()
+    for pack in get_packs():
+        data = pack.read(obj_hash)
+        if data is not None:
+            return data
+    raise Exception(f'Нет такого объекта {obj_hash}')
+
+
+def read_object(obj_hash):
+    '''
+    Возвращает распакованные байты объекта. Прочитанные объекты кэшируются на время команды
+    '''
+    data = object_cache.get(obj_hash)
+    if data is None:
+        data = read_stored(obj_hash)
+        if data[:len(DELTA_MAGIC)] == DELTA_MAGIC:
+            _, base_hash = DELTA_PREFIX.unpack_from(data)
+            # база обычно уже в кэше: соседние версии читаются подряд
+            data = delta.apply_delta(read_object(base_hash.hex()), decompress(data[DELTA_PREFIX.size:]))
+        else:
+            data = decompress(data)
+        if not isinstance(data, memoryview):
+            # отображенные в память объекты не кэшируем: повторное отображение дешево,
+            # а ссылка из кэша держала бы страницы файла в памяти процесса
+            object_cache.put(obj_hash, data)
+    return data
+
+
+def read_prefix(obj_hash, size):
+    '''
+    Первые size байт распакованного объекта (например, заголовок): сжатый объект распаковывается
+    только до нужной длины
+    '''
+    data = object_cache.get(obj_hash)
+    if data is not None:
+        return data[:size]
+    data = read_stored(obj_hash)
+    if is_delta(data):
+        return read_object(obj_hash)[:size]
+    if data[:len(COMPRESSED_MAGIC)] != COMPRESSED_MAGIC:
+        return bytes(data[:size])
+    magic, codec, level = COMPRESSED_HEADER.unpack_from(data)
+    if codec == CODECS['zlib']:
+        decompressor = zlib.decompressobj()
+    elif codec == CODECS['lzma']:
+        decompressor = lzma.LZMADecompressor()
+    else:
+        raise Exception(f'Неизвестный кодек сжатия {codec}')
+    result = b''
+    for start in range(COMPRESSED_HEADER.size, len(data), PREFIX_STEP):
+        result += decompressor.decompress(data[start:start + PREFIX_STEP], size - len(result))
+        if len(result) >= size:
+            break
+    return result
+
+
+def sync_folder(path):
+    '''
+    Сбрасывает на диск содержимое папки (новые имена переименованных файлов)
+    На Windows папку открыть нельзя, там переименование сбрасывается вместе с файлом
+    '''
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data: bytes):
+    '''
+    Записывает файл через временный файл и переименование: после сбоя в файле будет
+    либо старое, либо новое содержимое, но не его часть
+    '''
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    sync_folder(os.path.dirname(path))
+
+
+def write_object(obj_hash, data: bytes):
+    '''
+    Сохраняет объект: во время пакетной записи - во временный pack-файл, иначе как loose-файл
+    '''
+    data = compress(data)
+    if _batch is not None:
+        _batch.add(obj_hash, data)
+        # в индекс на диске объект попадет после публикации pack-файла
+        known_objects().add(obj_hash)
+        return
+    path = loose_path(obj_hash)
+    try:
+        file = open(path, 'wb')
+    except FileNotFoundError:
+        # первый объект с таким началом хэша - создаем подпапку
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file = open(path, 'wb')
+    with file:
+        file.write(data)
+    # дописываем в индекс только после записи самого объекта
+    known_objects().add(obj_hash)
+    with open(OBJECTS_INDEX_PATH, 'a') as file:
+        file.write(obj_hash + '\n')
+
+
+def publish_pack(tmp_path, entries, digest):
+    '''
+    Публикует записанный (и сброшенный на диск) временный pack-файл под именем по хэшу его содержимого
+    :param entries: словарь хэш -> (смещение, длина)
+    :param digest: sha1, посчитанный по байтам объектов в порядке записи - в имя входят и данные, и индекс,
+        поэтому pack с тем же именем совпадает с новым побайтно и не перезаписывается
+    :return: имя pack-файла
+    '''
+    hashes = sorted(entries)
+    index = [HEADER.pack(INDEX_MAGIC, PACK_VERSION, len(hashes))]
+    for obj_hash in hashes:
+        index.append(INDEX_ENTRY.pack(bytes.fromhex(obj_hash), *entries[obj_hash]))
+    index = b''.join(index)
+    digest.update(index)
+    name = 'pack-' + digest.hexdigest()
+    index_path = os.path.join(PACK_FOLDER, name + '.idx')
+    if os.path.exists(index_path):
+        # такой pack уже опубликован
+        os.remove(tmp_path)
+        return name
+    os.replace(tmp_path, os.path.join(PACK_FOLDER, name + '.pack'))
+    # индекс пишем последним: pack без индекса не виден при чтении
+    atomic_write(index_path, index)
+    return name
+
+
+def write_pack(objects):
+    '''
+    Записывает pack-файл и его индекс. Объекты пишутся потоком, в памяти держится только индекс
+    :param objects: итератор пар (хэш, байты объекта)
+    :return: имя pack-файла
+    '''
+    os.makedirs(PACK_FOLDER, exist_ok=True)
+    tmp_path = os.path.join(PACK_FOLDER, 'tmp_pack')
+    entries = {}
+    digest = hashlib.sha1()
+    offset = HEADER.size
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, 0))
+        for obj_hash, data in objects:
+            if obj_hash in entries:
+                continue
+            file.write(data)
+            digest.update(data)
+            entries[obj_hash] = (offset, len(data))
+            offset += len(data)
+        file.seek(0)
+        file.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, len(entries)))
+        # старые pack-файлы удаляются после записи нового, он должен быть на диске
+        file.flush()
+        os.fsync(file.fileno())
+    return publish_pack(tmp_path, entries, digest)
+
+
+_batch = None   # текущая пакетная запись
+
+
+class Batch:
+    '''
+    Пакетная запись объектов (with storage.Batch(): ...)
+    Объекты пишутся во временный pack-файл без fsync на каждый объект. В конце pack-файл сбрасывается
+    на диск одним fsync и атомарно переименовывается. Если запись прервана, временный файл удаляется
+    и в хранилище не остается ни одного объекта из пакета
+    '''
+
+    def __enter__(self):
+        global _batch
+        os.makedirs(PACK_FOLDER, exist_ok=True)
+        self.tmp_path = os.path.join(PACK_FOLDER, 'tmp_batch')
+        self.file = open(self.tmp_path, 'w+b')
+        self.file.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, 0))
+        self.entries = {}
+        self.digest = hashlib.sha1()
+        _batch = self
+        return self
+
+    def add(self, obj_hash, data):
+        if obj_hash in self.entries:
+            return
+        self.entries[obj_hash] = (self.file.tell(), len(data))
+        self.file.write(data)
+        self.digest.update(data)
+
+    def read(self, obj_hash):
+        found = self.entries.get(obj_hash)
+        if found is None:
+            return None
+        offset, length = found
+        self.file.seek(offset)
+        data = self.file.read(length)
+        self.file.seek(0, os.SEEK_END)
+        return data
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _batch, _known_objects
+        _batch = None
+        if exc_type is not None or not self.entries:
+            self.file.close()
+            os.remove(self.tmp_path)
+            if exc_type is not None:
+                # в множество известных объектов попали несохраненные объекты
+                _known_objects = None
+            return False
+        self.file.seek(0)
+        self.file.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, len(self.entries)))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        publish_pack(self.tmp_path, self.entries, self.digest)
+        with open(OBJECTS_INDEX_PATH, 'a') as file:
+            file.writelines(obj_hash + '\n' for obj_hash in self.entries)
+            # после пакета обычно обновляется HEAD - индекс должен попасть на диск раньше
+            file.flush()
+            os.fsync(file.fileno())
+        return False
+
+
+def is_delta(data):
+    return data[:len(DELTA_MAGIC)] == DELTA_MAGIC
+
+
+def choose_deltas(series, stored=None):
+    '''
+    Выбирает, какие объекты хранить дельтой
+    Базой версии служит предыдущая (более новая) версия той же серии: новые версии читаются чаще,
+    поэтому они хранятся целиком, а цепочки дельт ведут от новых версий к старым
+    :param series: итератор списков хэшей версий одного файла (или одного куска файла), от новых к старым
+    :param stored: объекты, которые уже хранятся дельтой и остаются ею (хэш -> хэш базы) - для них дельта
+        не пересчитывается, а их базы не становятся дельтами (иначе цепочки удлинялись бы и могли замкнуться)
+    :return: словарь хэш -> байты объекта в виде дельты
+    '''
+    max_depth = int(get_setting('STORAGE', 'delta_depth'))
+    bases = dict(stored or {})      # объект -> база его дельты (сохраненные и новые дельты)
+    stored_bases = set(bases.values())
+    deltas = {}
+    decided = set()     # каждый объект решаем один раз
+
+    def chain_depth(obj_hash):
+        depth = 0
+        while obj_hash in bases:
+            obj_hash = bases[obj_hash]
+            depth += 1
+        return depth
+
+    for versions in series:
+        base_hash = None
+        for obj_hash in versions:
+            if obj_hash in decided or not object_exists(obj_hash):
+                base_hash = obj_hash if obj_hash in decided else None
+                continue
+            decided.add(obj_hash)
+            if obj_hash not in bases and obj_hash not in stored_bases and \
+                    base_hash is not None and chain_depth(base_hash) < max_depth:
+                base, target = read_object(base_hash), read_object(obj_hash)
+                if len(target) <= len(base) * DELTA_SIZE_RATIO and len(base) <= len(target) * DELTA_SIZE_RATIO:
+                    # дельта выгодна, только если новых байт меньше половины объекта
+                    diff = delta.make_delta(base, target, max_insert=len(target) // 2)
+                    if diff is not None:
+                        diff = DELTA_PREFIX.pack(DELTA_MAGIC, bytes.fromhex(base_hash)) + compress(diff)
+                        if len(diff) < len(compress(target)):
+                            deltas[obj_hash] = diff
+                            bases[obj_hash] = base_hash
+            base_hash = obj_hash
+    return deltas
+
+
+def repack(series=(), exclude=frozenset(), keep=()):
+    '''
+    Упаковывает loose-объекты и pack-файлы в один pack
+    :param series: версии файлов от новых к старым (см. choose_deltas), похожие версии сохраняются дельтами
+    :param exclude: хэши объектов, которые не попадут в новый pack (удаляются)
+    :param keep: pack-файлы, которые не переписываются (их объекты остаются в них)
+    :return: количество упакованных объектов
+    '''
+    loose = loose_objects()
+    keep = {pack.name for pack in keep}
+    all_packs = get_packs()
+    packs = [pack for pack in all_packs if pack.name not in keep]
+    if not loose and len(packs) <= 1 and not series and not exclude:
+        return 0
+    # дельты, база которых остается в хранилище, переносятся как есть
+    stored = {}
+    for pack in all_packs:
+        stored.update(pack.delta_bases())
+    stored = {obj_hash: base_hash for obj_hash, base_hash in stored.items()
+              if obj_hash not in exclude and base_hash not in exclude}
+    deltas = choose_deltas(series, stored)
+    # время записи нового pack-файла - время самого нового из переупакованных объектов, чтобы сборка мусора
+    # не считала их моложе, чем они есть (см. collect_garbage)
+    written = [os.path.getmtime(pack.pack_path) for pack in packs] + \
+              [os.path.getmtime(path) for path in loose.values()]
+
+    def iter_objects():
+        for pack in packs:
+            for obj_hash in pack.hashes():
+                yield obj_hash, pack.read(obj_hash)
+        for obj_hash, path in loose.items():
+            with open(path, 'rb') as file:
+                yield obj_hash, file.read()
+
+    def iter_packed():
+        for obj_hash, data in iter_objects():
+            if obj_hash in exclude:
+                continue
+            if obj_hash in deltas:
+                data = deltas[obj_hash]
+            elif is_delta(data) and obj_hash not in stored:
+                # база дельты удаляется - распаковываем цепочку
+                data = compress(bytes(read_object(obj_hash)))
+            yield obj_hash, data
+
+    name = write_pack(iter_packed())
+    pack = Pack(name)
+    count = pack.count
+    if written:
+        os.utime(pack.pack_path, (max(written), max(written)))
+    old_packs = [pack.name for pack in packs if pack.name != name]
+    close_packs()
+    # удаляем то, что теперь лежит в новом pack-файле
+    for old_name in old_packs:
+        os.remove(os.path.join(PACK_FOLDER, old_name + '.idx'))
+        os.remove(os.path.join(PACK_FOLDER, old_name + '.pack'))
+    for path in loose.values():
+        os.remove(path)
+    # пустые подпапки тоже удаляем, чтобы не просматривать их при следующих обходах
+    for name in {os.path.dirname(path) for path in loose.values()}:
+        if name != str(DATA_FOLDER) and not os.listdir(name):
+            os.rmdir(name)
+    return count
+
+
+def consolidate():
+    '''
+    Объединяет loose-объекты и мелкие pack-файлы в один pack, без поиска дельт и удаления объектов.
+    Крупный pack-файл (больше, чем вдвое, всех меньших вместе с loose-объектами) не переписывается,
+    поэтому каждый объект переупаковывается лишь несколько раз за все время
+    :return: количество упакованных объектов
+    '''
+    sizes = {pack.name: os.path.getsize(pack.pack_path) for pack in get_packs()}
+    rest = sum(sizes.values()) + sum(os.path.getsize(path) for path in loose_objects().values())
+    keep = []
+    for pack in sorted(get_packs(), key=lambda pack: sizes[pack.name], reverse=True):
+        rest -= sizes[pack.name]
+        if sizes[pack.name] < 2 * rest:
+            break
+        keep.append(pack)
+    return repack(keep=keep)
+
+
+def needs_repack():
+    '''
+    Накопилось ли loose-объектов больше порога pack_threshold или pack-файлов больше pack_limit
+    '''
+    return len(loose_objects()) > int(get_setting('STORAGE', 'pack_threshold')) or \
+        len(get_packs()) > int(get_setting('STORAGE', 'pack_limit'))
+
+
+def load_object_times():
+    '''
+    Время записи недостижимых объектов, которые сборка мусора оставила до истечения gc_grace
+    (при упаковке объект попадает в новый pack-файл, и время самого pack-файла уже не подходит)
+    :return: словарь хэш -> timestamp
+    '''
+    times = {}
+    if OBJECT_TIMES_PATH.exists():
+        with open(OBJECT_TIMES_PATH, 'r') as file:
+            for line in file:
+                obj_hash, _, written = line.partition(' ')
+                times[obj_hash] = float(written)
+    return times
+
+
+def save_object_times(times):
+    if times:
+        atomic_write(OBJECT_TIMES_PATH, ''.join(f'{obj_hash} {written}\n' for obj_hash, written in times.items()).encode())
+    elif OBJECT_TIMES_PATH.exists():
+        os.remove(OBJECT_TIMES_PATH)
+
+
+def collect_garbage(reachable, expire, series=()):
+    '''
+    Удаляет недостижимые объекты, а остальные упаковывает в один pack
+    :param reachable: хэши объектов, достижимых из HEAD
+    :param expire: время (timestamp) - недостижимые объекты, записанные позже, пока не удаляются
+    :param series: версии файлов для выбора дельт (см. repack)
+    :return: количество удаленных объектов и их объем в хранилище (байт)
+    '''
+    saved_times = load_object_times()
+    times = {}      # недостижимый объект -> время его записи
+    sizes = {}      # недостижимый объект -> сколько он занимает в хранилище (байт)
+    for obj_hash, path in loose_objects().items():
+        if obj_hash not in reachable:
+            times[obj_hash] = os.path.getmtime(path)
+            sizes[obj_hash] = os.path.getsize(path)
+    for pack in get_packs():
+        # время объекта в pack-файле - сохраненное при прошлой сборке мусора или время создания pack-файла
+        pack_time = os.path.getmtime(pack.pack_path)
+        for i in range(pack.count):
+            entry_hash, offset, length = pack._entry(i)
+            obj_hash = entry_hash.hex()
+            if obj_hash not in reachable:
+                written = saved_times.get(obj_hash, pack_time)
+                times[obj_hash] = min(written, times.get(obj_hash, written))
+                sizes[obj_hash] = sizes.get(obj_hash, 0) + length
+    garbage = {obj_hash for obj_hash, written in times.items() if written < expire}
+    repack(series, exclude=garbage)
+    for obj_hash in garbage:
+        object_cache.remove(obj_hash)
+    # оставшиеся недостижимые объекты теперь в новом pack-файле - запоминаем, когда они были записаны
+    save_object_times({obj_hash: written for obj_hash, written in times.items() if obj_hash not in garbage})
+    rebuild_objects_index()
+    return len(garbage), sum(sizes[obj_hash] for obj_hash in garbage)
@@ -14,6 +14,11 @@ commands_dict = {
     'remote': {'ru': 'Указать ссылку на удаленный репозиторий', 'en': 'Provide a link to the remote repository'},
     'token': {'ru': 'Указать токен для работы с удаленным репозиторием', 'en': 'Provide a token to work with the remote repository'},
     'clone': {'ru': 'Клонировать (загрузить) репозиторий', 'en': 'Clone (download) repository'},
+    'repack': {'ru': 'Упаковать объекты репозитория в pack-файл', 'en': 'Pack repository objects into a pack file'},
+    'migrate': {'ru': 'Разложить объекты старого репозитория по подпапкам', 'en': 'Move objects of an old repository into subfolders'},
+    'watch': {'ru': 'Следить за изменениями в проекте (Linux), чтобы status и commit работали быстрее', 'en': 'Watch the project for changes (Linux) to speed up status and commit'},
+    'gc': {'ru': 'Удалить недостижимые объекты и упаковать остальные', 'en': 'Remove unreachable objects and pack the rest'},
+    'sparse': {'ru': 'Оставить в рабочей папке только пути по шаблонам (без шаблонов - весь проект)', 'en': 'Keep only paths matching the patterns in the working folder (no patterns - the whole project)'},
 }
 
 phrase = {
@@ -51,4 +56,11 @@ phrase = {
     'Пользователь': {'ru': 'Пользователь', 'en': 'User'},
     'Репозиторий': {'ru': 'Репозиторий', 'en': 'Repository'},
     'Клонировано в': {'ru': 'Клонировано в', 'en': 'Cloned into'},
+    'Упаковано объектов': {'ru': 'Упаковано объектов', 'en': 'Objects packed'},
+    'Перенесено объектов': {'ru': 'Перенесено объектов', 'en': 'Objects moved'},
+    'Наблюдение за изменениями запущено': {'ru': 'Наблюдение за изменениями запущено (Ctrl+C - остановить)', 'en': 'Watching for changes (Ctrl+C to stop)'},
+    'Удалено объектов': {'ru': 'Удалено объектов', 'en': 'Objects removed'},
+    'освобождено байт': {'ru': 'освобождено байт', 'en': 'bytes reclaimed'},
+    'Выборочное восстановление': {'ru': 'Выборочное восстановление', 'en': 'Sparse checkout'},
+    'Выборочное восстановление выключено': {'ru': 'Выборочное восстановление выключено', 'en': 'Sparse checkout disabled'},
 }
\ No newline at end of file
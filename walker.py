@@ -0,0 +1,279 @@
+import os
+import re
+
+import gitignore_parser
+
+from config import BASE_PATH, VCS_FOLDER, GITIGNORE
+
+'''
+Обход папок проекта на os.scandir, общий для iter_folder, шифрования и отправки на сервер.
+Тип записи (файл/папка) берется из DirEntry, заполненного при чтении папки, а наличие .gitignore -
+из списка имен, поэтому на запись приходится не больше одного системного вызова
+(stat файла через DirEntry.stat(), и только если он нужен).
+Порядок обхода: папка, затем ее вложенные папки, затем файлы (в порядке чтения папки).
+Записи из .gitignore отбрасываются при чтении папки, до попадания в стек обхода.
+'''
+
+
+WILDCARDS = re.compile(r'[*?[]')
+
+
+def compile_rules(rules):
+    return re.compile('|'.join(f'(?:{rule.regex})' for rule in rules)) if rules else None
+
+
+class GitignoreMatcher:
+    '''
+    Правила одного .gitignore, собранные в одно регулярное выражение
+    Путь проверяется относительно папки .gitignore, один раз для всех правил
+    '''
+
+    def __init__(self, rules, base_dir):
+        self.base_dir = str(base_dir)
+        self.prefix = os.path.join(self.base_dir, '')
+        # простые правила для обхода (см. ignores_child): имена, расширения, пути и префиксы от папки .gitignore
+        self.names, self.paths = set(), set()
+        suffixes, prefixes, rest = [], [], []
+        if any(rule.negation for rule in rules):
+            # с исключениями (!) решает последнее подошедшее правило
+            self.regex = None
+            self.rules = [(re.compile(rule.regex), rule.negation) for rule in reversed(rules)]
+        else:
+            self.regex = compile_rules(rules)
+            self.rules = []
+            for rule in rules:
+                pattern = rule.pattern[:-1] if rule.pattern.endswith('/') else rule.pattern
+                if not pattern or pattern.endswith(' ') or '\\' in pattern:
+                    rest.append(rule)
+                elif '/' not in pattern and not WILDCARDS.search(pattern):
+                    self.names.add(pattern)
+                elif pattern[0] == '*' and '/' not in pattern and not WILDCARDS.search(pattern[1:]):
+                    suffixes.append(pattern[1:])
+                elif not WILDCARDS.search(pattern) and pattern.strip('/'):
+                    self.paths.add(os.path.normpath(pattern.lstrip('/')))
+                elif pattern.endswith('/**') and not WILDCARDS.search(pattern[:-3]) and pattern[:-3].strip('/'):
+                    prefixes.append(os.path.join(os.path.normpath(pattern[:-3].lstrip('/')), ''))
+                else:
+                    rest.append(rule)
+        self.suffixes = tuple(suffixes)
+        self.prefixes = tuple(prefixes)
+        self.rest = compile_rules(rest)
+
+    def relative(self, file_path):
+        file_path = str(file_path)
+        if file_path.startswith(self.prefix):
+            return file_path[len(self.prefix):]
+        return os.path.relpath(os.path.abspath(file_path), self.base_dir)
+
+    def __call__(self, file_path):
+        rel_path = self.relative(file_path)
+        if self.regex is not None:
+            return self.regex.search(rel_path) is not None
+        for regex, negation in self.rules:
+            if regex.search(rel_path):
+                return not negation
+        return False
+
+    def ignores_child(self, file_path, name):
+        '''
+        То же, что self(file_path), для объекта, папки над которым уже проверены и не игнорируются:
+        тогда правилу-имени достаточно сравнить имя объекта, а правилу-пути - весь путь.
+        Простые правила проверяются без регулярных выражений, остальные - общим выражением
+        '''
+        if self.rules:
+            return self(file_path)
+        if name in self.names or self.suffixes and name.endswith(self.suffixes):
+            return True
+        if not self.paths and not self.prefixes and self.rest is None:
+            return False
+        rel_path = self.relative(file_path)
+        if rel_path in self.paths or self.prefixes and rel_path.startswith(self.prefixes):
+            return True
+        return self.rest is not None and self.rest.search(rel_path) is not None
+
+
+def parse_gitignore(full_path, base_dir=None):
+    if base_dir is None:
+        base_dir = gitignore_parser.dirname(full_path)
+    base_dir = gitignore_parser._normalize_path(base_dir)
+    rules = []
+    with open(full_path, encoding='utf-8') as ignore_file:
+        counter = 0
+        for line in ignore_file:
+            counter += 1
+            line = line.rstrip('\n')
+            rule = gitignore_parser.rule_from_pattern(line, base_path=base_dir, source=(full_path, counter))
+            if rule:
+                rules.append(rule)
+    return GitignoreMatcher(rules, base_dir)
+
+
+_gitignores = {}    # путь к .gitignore -> (время изменения, правила)
+
+
+def load_gitignore(full_path):
+    '''
+    Правила .gitignore: файл разбирается один раз и перечитывается, только если изменилось время его изменения
+    (процесс может жить долго, например наблюдатель)
+    '''
+    mtime = os.stat(full_path).st_mtime_ns
+    cached = _gitignores.get(full_path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, parse_gitignore(full_path))
+        _gitignores[full_path] = cached
+    return cached[1]
+
+
+def obj_in_gitignore(obj, obj_tab, gitignore_stack, gitignore):
+    '''
+    Проверяет находится ли obj в .gitignore
+    :param obj: Путь к объекту файловой системы
+    :param obj_tab: уровень вложенности объекта
+    :param gitignore_stack: список файлов gitignore, их уровней вложенности и правил (см. load_gitignore)
+    :return:
+    '''
+    if not gitignore:
+        return False
+    if os.path.basename(obj) == VCS_FOLDER.name:  # игнорируем папку репозитория
+        return True
+    for gitignore_path, tab, matches in gitignore_stack:
+        if tab <= obj_tab and matches(obj):
+            return True
+    return False
+
+
+class WalkEntry:
+    '''
+    Файл или папка, найденные при обходе
+    '''
+    __slots__ = ('parent', 'name', 'tab', 'is_folder', 'dir_entry', 'from_index', 'rel_path',
+                 'has_gitignore', 'skip', '_path')
+
+    def __init__(self, parent, name, is_folder, dir_entry=None, from_index=False):
+        self.parent = parent
+        self.name = name
+        self.tab = parent.tab + 1 if parent is not None else 0     # уровень вложенности
+        self.is_folder = is_folder
+        self.dir_entry = dir_entry
+        self.from_index = from_index    # запись взята не с диска, а из списка list_folder
+        if parent is not None:
+            # путь относительно корня проекта (имена без разделителей - склеиваем без os.path.join)
+            self.rel_path = name if parent.rel_path == '.' else parent.rel_path + os.sep + name
+        self.has_gitignore = False  # есть ли в папке .gitignore
+        self.skip = False   # вызывающий код может запретить заходить в папку
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            # путь строим при первом обращении: родительскую папку могли переименовать
+            parent_path = self.parent.path
+            self._path = parent_path + self.name if parent_path.endswith(os.sep) else parent_path + os.sep + self.name
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        self._path = path
+
+    def stat(self):
+        if self.dir_entry is not None:
+            return self.dir_entry.stat()
+        return os.stat(self.path)
+
+
+class Walker:
+    '''
+    Обход папки в глубину: for entry in Walker(path): ...
+    Содержимое папки читается до того, как папка будет возвращена, поэтому peek_tab() видит ее первую запись
+    '''
+
+    def __init__(self, path=BASE_PATH, gitignore=True, folders_first=True, list_folder=None):
+        '''
+        :param gitignore: пропускать файлы из .gitignore и папку репозитория
+        :param folders_first: в папке сначала обходить вложенные папки, затем файлы (иначе - в порядке чтения папки)
+        :param list_folder: функция(entry) -> список (имя, папка ли) или None - содержимое папки без чтения с диска
+        '''
+        self.path = str(path)
+        self.gitignore = gitignore
+        self.folders_first = folders_first
+        self.list_folder = list_folder
+        self.stack = []
+        self.gitignore_stack = []
+
+    def peek_tab(self):
+        '''
+        Уровень вложенности следующей записи или None, если обход закончен
+        '''
+        return self.stack[-1].tab if self.stack else None
+
+    def ignored(self, entry):
+        '''
+        Проверяет запись до того, как она попадет в стек: игнорируемые папки (node_modules, .venv)
+        не читаются и не обходятся вовсе
+        '''
+        if entry.name == VCS_FOLDER.name:  # игнорируем папку репозитория
+            return True
+        for _, _, matcher in self.gitignore_stack:
+            if matcher.ignores_child(entry.path, entry.name):
+                return True
+        return False
+
+    def list_entries(self, entry):
+        names = self.list_folder(entry) if self.list_folder is not None else None
+        if names is not None:
+            entry.has_gitignore = self.gitignore and os.path.exists(os.path.join(entry.path, GITIGNORE))
+            children = [WalkEntry(entry, name, folder, from_index=True) for name, folder in names]
+        else:
+            with os.scandir(entry.path) as dir_entries:
+                dir_entries = list(dir_entries)
+            entry.has_gitignore = any(dir_entry.name == GITIGNORE for dir_entry in dir_entries)
+            if not self.folders_first:
+                children = [WalkEntry(entry, dir_entry.name, dir_entry.is_dir(), dir_entry) for dir_entry in dir_entries]
+            else:
+                folders, files = [], []
+                for dir_entry in dir_entries:
+                    if dir_entry.is_dir():
+                        folders.append(WalkEntry(entry, dir_entry.name, True, dir_entry))
+                    elif dir_entry.is_file():
+                        files.append(WalkEntry(entry, dir_entry.name, False, dir_entry))
+                children = folders + files
+        if not self.gitignore:
+            return children
+        if entry.has_gitignore:
+            # правила папки действуют на ее содержимое, снимаются со стека при выходе из папки
+            gitignore_path = os.path.join(entry.path, GITIGNORE)
+            self.gitignore_stack.append((gitignore_path, entry.tab + 1, load_gitignore(gitignore_path)))
+        return [child for child in children if not self.ignored(child)]
+
+    def __iter__(self):
+        root = WalkEntry(None, os.path.basename(self.path), os.path.isdir(self.path))
+        root.path = self.path
+        root.rel_path = os.path.relpath(self.path, BASE_PATH)
+        self.stack = []
+        self.gitignore_stack = []  # файлы gitignore, их уровень вложенности и правила
+        if self.gitignore:
+            # правила папки над корнем обхода, а для папки внутри проекта - всех папок от корня проекта
+            folders = [os.path.dirname(self.path)]
+            while folders[-1].startswith(os.path.join(str(BASE_PATH), '')):
+                folders.append(os.path.dirname(folders[-1]))
+            for folder in reversed(folders):
+                gitignore_path = os.path.join(folder, GITIGNORE)
+                if os.path.exists(gitignore_path):
+                    self.gitignore_stack.append((gitignore_path, 0, load_gitignore(gitignore_path)))
+            if obj_in_gitignore(root.path, root.tab, self.gitignore_stack, True):
+                return
+        self.stack = [root]
+        while self.stack:
+            entry = self.stack.pop()
+            # удаляем файл gitignore из стека, когда перебрали все файлы в его уровне вложенности
+            while self.gitignore_stack and self.gitignore_stack[-1][1] > entry.tab:
+                self.gitignore_stack.pop()
+
+            count = 0
+            if entry.is_folder:
+                children = self.list_entries(entry)
+                count = len(children)
+                self.stack.extend(reversed(children))
+            yield entry
+            if entry.skip and count:
+                del self.stack[-count:]
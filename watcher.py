@@ -0,0 +1,262 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import time
+import uuid
+
+from config import BASE_PATH, VCS_FOLDER, GITIGNORE, WATCH_STATE_PATH, DIRTY_LOG_PATH, WATCH_COOKIES_FOLDER, \
+    get_setting
+from walker import Walker
+
+'''
+Наблюдение за рабочей папкой через inotify (только Linux, через ctypes - без сторонних библиотек).
+Команда watch запускает наблюдатель, который дописывает в журнал DIRTY_LOG_PATH папки
+(пути относительно корня проекта), в которых что-то изменилось. Обход проекта (iter_folder) читает журнал
+с позиции, сохраненной в индексе при прошлом обходе, и заново просматривает только эти папки,
+а содержимое остальных берет из индекса.
+Если наблюдатель не запущен, был перезапущен или потерял события (переполнение очереди,
+изменение .gitignore - в журнал пишется FULL_WALK), выполняется полный обход.
+Перед чтением журнала обход создает файл-метку (cookie) в WATCH_COOKIES_FOLDER и ждет, пока наблюдатель
+запишет ее в журнал: события inotify приходят по порядку, поэтому все изменения, сделанные до метки,
+к этому моменту уже в журнале (как cookie у git fsmonitor). Не дождались - выполняется полный обход.
+За игнорируемыми папками не наблюдаем. Если наблюдение за папкой установить не удалось
+(например, исчерпан лимит max_user_watches), наблюдатель завершается.
+'''
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT = struct.Struct('iIII')   # дескриптор наблюдения, маска, cookie, длина имени
+FULL_WALK = '*'     # запись журнала: события потеряны, нужен полный обход
+COOKIE = '/'        # запись журнала: COOKIE + имя метки (пути папок относительные и с '/' не начинаются)
+
+
+class Watcher:
+    '''
+    Наблюдатель inotify за всеми папками проекта (кроме папки репозитория)
+    '''
+
+    def __init__(self, root=BASE_PATH):
+        self.root = str(root)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.folders = {}   # дескриптор наблюдения -> путь папки относительно корня
+        self.cookies_wd = None  # дескриптор наблюдения за папкой меток
+
+    def add_folder(self, rel_path, dirty):
+        '''
+        Начинает наблюдение за папкой и всеми вложенными в нее, кроме игнорируемых (.gitignore):
+        их обход все равно пропускает, а каждое наблюдение расходует лимит max_user_watches
+        :param dirty: множество, в которое добавляются пути этих папок
+        '''
+        path = os.path.normpath(os.path.join(self.root, rel_path))
+        while True:
+            try:
+                for entry in Walker(path):
+                    if entry.is_folder and not self.add_watch(entry.rel_path):
+                        entry.skip = True
+                    elif entry.is_folder:
+                        dirty.add(entry.rel_path)
+                return
+            except (FileNotFoundError, NotADirectoryError):
+                # папку удалили во время обхода - обходим заново (повторное наблюдение за папкой не дублируется)
+                if not os.path.isdir(path):
+                    return
+
+    def add_watch(self, rel_path):
+        '''
+        Начинает наблюдение за одной папкой
+        :return: False, если папку уже удалили
+        '''
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(os.path.join(self.root, rel_path)), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            # без наблюдения изменения в папке не попадут в журнал - прекращаем работу, обход станет полным
+            message = f'Не удалось начать наблюдение за папкой {rel_path}: {os.strerror(error)}'
+            if error == errno.ENOSPC:
+                message += ' (увеличьте fs.inotify.max_user_watches)'
+            raise Exception(message)
+        self.folders[wd] = rel_path
+        return True
+
+    def read_events(self):
+        '''
+        Ждет и обрабатывает события
+        :return: множество изменившихся папок (FULL_WALK - события потеряны) и список меток (COOKIE + имя)
+            в порядке создания
+        '''
+        select.select([self.fd], [], [])
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set(), []
+        dirty = set()
+        cookies = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0'))
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                dirty.add(FULL_WALK)
+                continue
+            if wd == self.cookies_wd:
+                if mask & IN_CREATE:
+                    cookies.append(COOKIE + name)
+                continue
+            folder = self.folders.get(wd)
+            if folder is None or folder == '.' and name == VCS_FOLDER.name:
+                continue
+            if mask & IN_IGNORED:
+                # папка удалена, наблюдение снято ядром
+                del self.folders[wd]
+                continue
+            dirty.add(folder)
+            if name == GITIGNORE:
+                # правила игнорирования действуют и на вложенные папки; папки, которые перестали
+                # игнорироваться, начинаем наблюдать
+                dirty.add(FULL_WALK)
+                self.add_folder(folder, dirty)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # новая (или перемещенная) папка: наблюдаем за ней, все ее папки считаем измененными
+                self.add_folder(os.path.normpath(os.path.join(folder, name)), dirty)
+        return dirty, cookies
+
+    def run(self):
+        '''
+        Наблюдает за проектом, пока процесс не остановят
+        '''
+        with open(DIRTY_LOG_PATH, 'w'):
+            pass
+        # метки, оставшиеся от прерванных обходов, больше никто не ждет
+        os.makedirs(WATCH_COOKIES_FOLDER, exist_ok=True)
+        for name in os.listdir(WATCH_COOKIES_FOLDER):
+            os.remove(os.path.join(WATCH_COOKIES_FOLDER, name))
+        self.cookies_wd = self.libc.inotify_add_watch(self.fd, os.fsencode(WATCH_COOKIES_FOLDER), IN_CREATE | IN_ONLYDIR)
+        if self.cookies_wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(WATCH_COOKIES_FOLDER))
+        self.add_folder('.', set())
+        # состояние записываем, когда наблюдение установлено за всеми папками:
+        # новый токен означает, что предыдущие записи индекса проверяются полным обходом
+        token = uuid.uuid4().hex
+        tmp_path = str(WATCH_STATE_PATH) + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(f'{os.getpid()} {token}')
+        os.replace(tmp_path, WATCH_STATE_PATH)
+        # завершение по Ctrl+C или kill: состояние удаляется, следующий обход будет полным
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            with open(DIRTY_LOG_PATH, 'a', encoding='utf-8', errors='surrogateescape') as log:
+                while True:
+                    dirty, cookies = self.read_events()
+                    if dirty or cookies:
+                        # одна запись на пакет событий, строки пишутся целиком;
+                        # метки - последними: когда метка видна, видны и все изменения до нее
+                        log.write(''.join(line + '\n' for line in sorted(dirty) + cookies))
+                        log.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(WATCH_STATE_PATH)
+            os.close(self.fd)
+
+
+def watcher_token():
+    '''
+    Токен запущенного наблюдателя или None
+    '''
+    try:
+        with open(WATCH_STATE_PATH, 'r') as file:
+            pid, token = file.read().split()
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        # наблюдатель не запущен или завершился аварийно
+        return None
+    return token
+
+
+def wait_cookie(offset):
+    '''
+    Создает метку и ждет, пока наблюдатель запишет ее в журнал
+    :param offset: позиция в журнале, с которой читать
+    :return: прочитанные записи журнала с offset (полными строками) и дождались ли метки
+        (если нет - в журнале могут быть не все изменения)
+    '''
+    name = f'{os.getpid()}-{uuid.uuid4().hex}'
+    cookie_path = os.path.join(WATCH_COOKIES_FOLDER, name)
+    deadline = time.monotonic() + float(get_setting('WATCH', 'cookie_timeout'))
+    data = b''
+    try:
+        with open(cookie_path, 'w'):
+            pass
+        with open(DIRTY_LOG_PATH, 'rb') as file:
+            file.seek(offset)
+            while True:
+                data += file.read()
+                # последняя строка может быть еще не дописана - ее прочитаем в следующий раз
+                lines = data[:data.rfind(b'\n') + 1]
+                if (COOKIE + name + '\n').encode() in lines:
+                    return lines, True
+                if time.monotonic() > deadline:
+                    return lines, False
+                time.sleep(0.001)
+    except FileNotFoundError:
+        # наблюдатель завершился или не создавал папку меток
+        return data[:data.rfind(b'\n') + 1], False
+    finally:
+        try:
+            os.remove(cookie_path)
+        except FileNotFoundError:
+            pass
+
+
+def changes_since(session):
+    '''
+    Папки, изменившиеся с прошлого обхода
+    :param session: (токен наблюдателя, позиция в журнале) с прошлого обхода или None
+    :return: новая сессия (None, если наблюдатель не запущен) и множество путей изменившихся папок
+        относительно корня проекта (None - нужен полный обход)
+    '''
+    token = watcher_token()
+    if token is None:
+        return None, None
+    if session is None or session[0] != token:
+        with open(DIRTY_LOG_PATH, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            return (token, file.tell()), None
+    data, synced = wait_cookie(session[1])
+    dirty = {line for line in os.fsdecode(data).splitlines() if not line.startswith(COOKIE)}
+    if not synced or FULL_WALK in dirty:
+        # журнал мог отстать от изменений - полный обход; записи, которые допишутся позже,
+        # при следующем обходе только заставят просмотреть папки еще раз
+        return (token, session[1] + len(data)), None
+    return (token, session[1] + len(data)), dirty
+
+
+def watch():
+    if not sys.platform.startswith('linux'):
+        raise Exception('Наблюдение за изменениями (inotify) доступно только в Linux')
+    Watcher().run()